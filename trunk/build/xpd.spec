@@ -41,6 +41,7 @@ rm -rf $RPM_BUILD_ROOT
 %{python_site}/%{name}m/*
 %{python_site}/%{name}-%{version}*-info
 %{_bindir}/xpd
+%{_bindir}/xpd-cli
 %{_datadir}/applications/*.desktop
 %{_datadir}/pixmaps/*
 %{_datadir}/%{name}/*
@@ -70,7 +70,7 @@ setup (name = 'xpd',
             ],
         packages = ["xpdm"],
         package_dir = { "xpdm": "xpdm" },
-        scripts = ['xpd'],
+        scripts = ['xpd', 'xpd-cli'],
         data_files = [
             ('share/xpd', ['share/gui.xml', 'share/xpd.svg'] + glob.glob ('share/*.asv')),
             ('share/applications', ['build/xpd.desktop']),
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+# Conversion between raw parameter values and physical values (amps, volts,
+# percents) over whole arrays at once, for reports over large profile
+# libraries. Requires NumPy.
+#
+
+import types
+import numpy
+from xpdm import infineon
+
+
+def Round (x):
+    """Array version of the built-in round (): halves go away from zero,
+    unlike numpy.round () which rounds them to even"""
+    a = numpy.abs (x)
+    r = numpy.floor (a)
+    r += (a - r) >= 0.5
+    return numpy.copysign (r, x)
+
+
+def Vectorize (func, namespace):
+    """Return a copy of a parameter conversion function which works on
+    arrays. The functions are plain arithmetic except for round (), so it
+    is enough to run the same code with an array-aware round ()."""
+    return types.FunctionType (func.func_code, namespace, func.func_name,
+        func.func_defaults, func.func_closure)
+
+
+class BatchConverter:
+    """Converts the spin button parameters of a controller family.
+    Controller types are given as ControllerType values (1-based indices
+    into ControllerTypeDesc); unknown types convert like the first one,
+    the same as Profile.GetController () does."""
+
+    def __init__ (self, ControllerTypeDesc, ControllerParameters):
+        self.ControllerTypeDesc = ControllerTypeDesc
+        self.Types = len (ControllerTypeDesc)
+        # Raw -> displayed value tables, indexed by [ControllerType, raw]
+        self.Tables = {}
+        # Vectorized displayed -> raw value functions
+        self.SetDisplay = {}
+        self.Depends = {}
+
+        namespaces = {}
+        for parm, desc in ControllerParameters.items ():
+            if desc ["Widget"] != infineon.PWT_SPINBUTTON:
+                continue
+
+            getf = desc.get ("GetDisplayFunc", desc ["GetDisplay"])
+            setf = desc.get ("SetDisplayFunc", desc ["SetDisplay"])
+            ns = namespaces.get (id (setf.func_globals))
+            if ns is None:
+                ns = dict (setf.func_globals)
+                ns ["round"] = Round
+                namespaces [id (setf.func_globals)] = ns
+            getf = Vectorize (getf, ns)
+            self.SetDisplay [parm] = Vectorize (setf, ns)
+            self.Depends [parm] = "ControllerType" in desc.get ("Depends", [])
+
+            # Row 0 is for unknown controller types
+            raw = numpy.arange (256, dtype = numpy.float64)
+            tab = numpy.empty ((self.Types + 1, 256))
+            for ct in range (1, self.Types + 1):
+                if self.Depends [parm] or (ct == 1):
+                    tab [ct] = getf (infineon.TableProfile (ControllerTypeDesc, ct), raw)
+                else:
+                    tab [ct] = tab [1]
+            tab [0] = tab [1]
+            self.Tables [parm] = tab
+
+
+    def Parameters (self):
+        return self.Tables.keys ()
+
+
+    def ControllerTypes (self, ct, shape):
+        ct = numpy.asarray (ct, dtype = numpy.intp)
+        if ct.ndim == 0:
+            ct = numpy.resize (ct, shape)
+        return numpy.where ((ct >= 1) & (ct <= self.Types), ct, 0)
+
+
+    def ToDisplay (self, parm, raw, ct = 1):
+        """Convert an array of raw values (integers 0-255) of given
+        parameter to displayed values. ct is either an array of controller
+        types of the same shape, or a single controller type."""
+        raw = numpy.asarray (raw, dtype = numpy.intp)
+        return self.Tables [parm][self.ControllerTypes (ct, raw.shape), raw]
+
+
+    def ToRaw (self, parm, val, ct = 1):
+        """Convert an array of displayed values of given parameter
+        to raw values. The result is a float array, just like
+        SetDisplay returns floats; the values are not clipped."""
+        val = numpy.asarray (val, dtype = numpy.float64)
+        setf = self.SetDisplay [parm]
+        if not self.Depends [parm]:
+            return numpy.array (setf (infineon.TableProfile (self.ControllerTypeDesc, 1), val),
+                dtype = numpy.float64)
+
+        ct = self.ControllerTypes (ct, val.shape)
+        raw = numpy.empty (val.shape)
+        for t in numpy.unique (ct):
+            sel = ct == t
+            raw [sel] = setf (infineon.TableProfile (self.ControllerTypeDesc, max (t, 1)), val [sel])
+        return raw
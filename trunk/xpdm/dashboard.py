@@ -0,0 +1,240 @@
+#
+# Fleet upload dashboard: one row per serial port, every port is programmed
+# by its own upload worker and can be started, cancelled or retried alone
+#
+
+import time
+import threading
+import gtk
+import glib
+from xpdm import infineon, fleet
+
+# Dashboard list columns
+DC_PORT = 0
+DC_PROFILE = 1
+DC_PHASE = 2
+DC_ELAPSED = 3
+DC_RESULT = 4
+
+
+class DashboardPort:
+    """The state of a single port on the dashboard"""
+
+    def __init__ (self, port):
+        self.Port = port
+        self.Profile = None
+        self.Worker = None
+        self.Cancel = threading.Event ()
+        # Whether the last upload did not succeed
+        self.Failed = False
+        self.Row = None
+
+
+    def Running (self):
+        return self.Worker != None
+
+
+class Dashboard:
+    def __init__ (self, app):
+        self.App = app
+        self.Ports = {}
+        self.Timer = None
+
+        self.Window = gtk.Window ()
+        self.Window.set_title (_("Fleet upload"))
+        self.Window.set_transient_for (app.MainWindow)
+        self.Window.set_default_size (640, 360)
+        self.Window.set_border_width (5)
+        self.Window.connect ("delete-event", self.on_Window_delete)
+
+        vbox = gtk.VBox (False, 5)
+        self.Window.add (vbox)
+
+        self.Store = gtk.ListStore (str, str, str, str, str)
+        self.List = gtk.TreeView (self.Store)
+        self.List.get_selection ().set_mode (gtk.SELECTION_MULTIPLE)
+        for title, col in (_("Port"), DC_PORT), (_("Profile"), DC_PROFILE), \
+                          (_("Phase"), DC_PHASE), (_("Elapsed"), DC_ELAPSED), \
+                          (_("Result"), DC_RESULT):
+            column = gtk.TreeViewColumn (title, gtk.CellRendererText (), text = col)
+            column.set_resizable (True)
+            self.List.append_column (column)
+
+        sw = gtk.ScrolledWindow ()
+        sw.set_policy (gtk.POLICY_AUTOMATIC, gtk.POLICY_AUTOMATIC)
+        sw.set_shadow_type (gtk.SHADOW_IN)
+        sw.add (self.List)
+        vbox.pack_start (sw, True, True, 0)
+
+        bbox = gtk.HButtonBox ()
+        bbox.set_layout (gtk.BUTTONBOX_END)
+        bbox.set_spacing (5)
+        for label, func in (_("_Assign profile"), self.on_ButtonAssign_clicked), \
+                           (_("_Start"), self.on_ButtonStart_clicked), \
+                           ("gtk-cancel", self.on_ButtonCancel_clicked), \
+                           (_("_Retry failed"), self.on_ButtonRetry_clicked), \
+                           ("gtk-close", self.on_ButtonClose_clicked):
+            if label.startswith ("gtk-"):
+                but = gtk.Button (stock = label)
+            else:
+                but = gtk.Button (label, use_underline = True)
+            but.connect ("clicked", func)
+            bbox.pack_start (but, False, False, 0)
+        vbox.pack_start (bbox, False, True, 0)
+
+        for port in sorted (app.PortWatcher.Ports, key = fleet.PortOrder):
+            self.AddPort (port)
+        app.PortWatcher.Subscribe (self.on_SerialPort_changed)
+
+        self.Window.show_all ()
+
+
+    def AddPort (self, port):
+        if self.Ports.has_key (port):
+            return
+        dp = DashboardPort (port)
+        self.Ports [port] = dp
+
+        # Keep the same order as in the main window
+        idx = 0
+        while (idx < len (self.Store)) and \
+              (fleet.PortOrder (self.Store [idx][DC_PORT]) < fleet.PortOrder (port)):
+            idx += 1
+        i = self.Store.insert (idx, [port, "", _("Idle"), "", ""])
+        dp.Row = gtk.TreeRowReference (self.Store, self.Store.get_path (i))
+
+
+    def RemovePort (self, port):
+        dp = self.Ports.pop (port, None)
+        if (dp != None) and dp.Row.valid ():
+            self.Store.remove (self.Store.get_iter (dp.Row.get_path ()))
+
+
+    def SetRow (self, dp, values):
+        """Set the given {column : value} of the port's row"""
+        if not dp.Row.valid ():
+            return
+        row = self.Store [dp.Row.get_path ()]
+        for col, value in values.items ():
+            row [col] = value
+
+
+    def SelectedPorts (self):
+        """Return the selected ports, or all of them if none is selected"""
+        model, paths = self.List.get_selection ().get_selected_rows ()
+        if not paths:
+            paths = [row.path for row in self.Store]
+        return [self.Ports [self.Store [path][DC_PORT]] for path in paths]
+
+
+    def Start (self, dp):
+        if dp.Running () or (dp.Profile is None):
+            return
+        # Another worker (from the main window or a closed dashboard) holds the port
+        if self.App.BusyPorts.has_key (dp.Port):
+            self.SetRow (dp, { DC_RESULT : _("Serial port is busy") })
+            return
+
+        dp.Cancel.clear ()
+        dp.Worker = fleet.PortUpload (dp.Profile, dp.Port, dp.Cancel,
+            progress_func = lambda worker, pos = None, msg = None, phase = None: \
+                glib.idle_add (self.UpdatePort, dp, worker, phase, worker.Status))
+        self.SetRow (dp, { DC_PHASE : infineon.UploadPhaseDesc [infineon.UPH_OPEN],
+            DC_ELAPSED : "0.0", DC_RESULT : fleet.FleetStatusDesc [fleet.FUS_RUNNING] })
+        self.App.BusyPorts [dp.Port] = dp.Worker
+        dp.Worker.start ()
+
+        if self.Timer is None:
+            self.Timer = glib.timeout_add (200, self.Tick)
+
+
+    def UpdatePort (self, dp, worker, phase, status):
+        # Called in the main thread for every progress report of a worker
+        if worker is not dp.Worker:
+            return False
+
+        if status in (fleet.FUS_PENDING, fleet.FUS_RUNNING):
+            if phase != None:
+                self.SetRow (dp, { DC_PHASE : infineon.UploadPhaseDesc [phase] })
+            return False
+
+        dp.Worker = None
+        self.App.BusyPorts.pop (dp.Port, None)
+        result = fleet.FleetStatusDesc [status]
+        if worker.Message:
+            result += ": " + worker.Message
+        self.SetRow (dp, { DC_PHASE : _("Idle"), DC_ELAPSED : "%.1f" % worker.Elapsed,
+            DC_RESULT : result })
+        dp.Failed = status != fleet.FUS_OK
+
+        # The port went away while uploading
+        if dp.Port not in self.App.PortWatcher.Ports:
+            self.RemovePort (dp.Port)
+        return False
+
+
+    def Tick (self):
+        running = [dp for dp in self.Ports.values () if dp.Running ()]
+        for dp in running:
+            if dp.Worker.StartTime != None:
+                self.SetRow (dp, { DC_ELAPSED : "%.1f" % (time.time () - dp.Worker.StartTime) })
+        if not running:
+            self.Timer = None
+            return False
+        return True
+
+
+    def Close (self):
+        for dp in self.Ports.values ():
+            dp.Cancel.set ()
+        if self.Timer != None:
+            glib.source_remove (self.Timer)
+            self.Timer = None
+        self.App.PortWatcher.Unsubscribe (self.on_SerialPort_changed)
+        self.Window.destroy ()
+        self.App.Dashboard = None
+
+
+# -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- #
+
+
+    def on_Window_delete (self, win, event):
+        self.Close ()
+        return True
+
+
+    def on_ButtonClose_clicked (self, but):
+        self.Close ()
+
+
+    def on_ButtonAssign_clicked (self, but):
+        prof = self.App.LoadSelectedProfile ()
+        if prof is None:
+            return
+        for dp in self.SelectedPorts ():
+            if not dp.Running ():
+                dp.Profile = prof
+                self.SetRow (dp, { DC_PROFILE : prof.Description, DC_RESULT : "" })
+
+
+    def on_ButtonStart_clicked (self, but):
+        for dp in self.SelectedPorts ():
+            self.Start (dp)
+
+
+    def on_ButtonCancel_clicked (self, but):
+        for dp in self.SelectedPorts ():
+            dp.Cancel.set ()
+
+
+    def on_ButtonRetry_clicked (self, but):
+        for dp in self.SelectedPorts ():
+            if dp.Failed:
+                self.Start (dp)
+
+
+    def on_SerialPort_changed (self, port, added):
+        if added:
+            self.AddPort (port)
+        elif self.Ports.has_key (port) and not self.Ports [port].Running ():
+            self.RemovePort (port)
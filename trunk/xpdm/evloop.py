@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+# A tiny event loop to drive many serial ports from a single thread
+#
+# Coroutines are plain generators which yield wait requests (Readable or
+# Sleep) and finish by raising Return (value). A task is cancelled by
+# throwing Cancelled into its generator at the point where it waits.
+# POSIX only, since it waits on serial port file descriptors.
+#
+
+import time
+import heapq
+import select
+import locale
+import serial
+
+
+class Return (Exception):
+    """Raise this from a coroutine to finish it with a result"""
+    def __init__ (self, value = None):
+        Exception.__init__ (self)
+        self.Value = value
+
+
+class Cancelled (Exception):
+    """Thrown into a coroutine when its task is cancelled"""
+    pass
+
+
+class Readable:
+    """Yield this from a coroutine to wait until the file descriptor (or
+    anything with a fileno () method) becomes readable. The yield evaluates
+    to True if there is data to read, or False if the timeout expired."""
+    def __init__ (self, fd, timeout = None):
+        if hasattr (fd, "fileno"):
+            fd = fd.fileno ()
+        self.fd = fd
+        self.Timeout = timeout
+
+
+class Sleep:
+    """Yield this from a coroutine to suspend it for given amount of seconds"""
+    def __init__ (self, delay):
+        self.Delay = delay
+
+
+class Task:
+    def __init__ (self, loop, coro, name = None):
+        self.Loop = loop
+        self.Coro = coro
+        self.Name = name
+        self.Done = False
+        self.Cancelled = False
+        # Set until Cancelled is thrown into the coroutine
+        self.CancelPending = False
+        self.Result = None
+        self.Error = None
+        self.StartTime = time.time ()
+        self.Elapsed = 0.0
+        # The file descriptor the task waits on, if any
+        self.WaitFd = None
+        # Sequence number of the active timer, to ignore stale timers
+        self.TimerSeq = None
+
+
+    def Cancel (self):
+        self.Loop.CancelTask (self)
+
+
+class EventLoop:
+    def __init__ (self):
+        self.Tasks = []
+        # Tasks ready to run along with the value to send into them
+        self.Ready = []
+        # A heap of (deadline, seq, func) tuples
+        self.Timers = []
+        self.TimerSeq = 0
+        # File descriptor -> waiting task
+        self.Readers = {}
+        self.Poll = select.poll ()
+
+
+    def Spawn (self, coro, name = None, timeout = None):
+        """Start running a coroutine. If a timeout is given, the task
+        is cancelled if it does not finish in given amount of seconds"""
+        task = Task (self, coro, name)
+        self.Tasks.append (task)
+        self.Ready.append ((task, None, None))
+        if timeout != None:
+            self.CallLater (timeout, task.Cancel)
+        return task
+
+
+    def CallLater (self, delay, func):
+        self.TimerSeq += 1
+        heapq.heappush (self.Timers, (time.time () + delay, self.TimerSeq, func))
+
+
+    def CancelTask (self, task):
+        if task.Done or task.Cancelled:
+            return
+        task.Cancelled = True
+        task.CancelPending = True
+        self.Unwait (task)
+        self.Ready.append ((task, None, Cancelled ()))
+
+
+    def Unwait (self, task):
+        if task.WaitFd != None:
+            self.Poll.unregister (task.WaitFd)
+            del self.Readers [task.WaitFd]
+            task.WaitFd = None
+        task.TimerSeq = None
+
+
+    def Wakeup (self, task, seq, value):
+        # Called by a timer when a task should be resumed
+        if task.TimerSeq == seq:
+            self.Unwait (task)
+            self.Ready.append ((task, value, None))
+
+
+    def Step (self, task, value, exc):
+        if task.CancelPending:
+            # Drop any wakeups that were queued before the task was cancelled
+            if not isinstance (exc, Cancelled):
+                return
+            task.CancelPending = False
+
+        try:
+            if exc != None:
+                req = task.Coro.throw (exc)
+            else:
+                req = task.Coro.send (value)
+        except Return, r:
+            self.Finish (task, r.Value, None)
+            return
+        except StopIteration:
+            self.Finish (task, None, None)
+            return
+        except Cancelled:
+            self.Finish (task, False, None)
+            return
+        except Exception, e:
+            self.Finish (task, None, e)
+            return
+
+        if isinstance (req, Readable):
+            if self.Readers.has_key (req.fd):
+                self.Finish (task, None, ValueError ("fd %d is already waited on" % req.fd))
+                return
+            task.WaitFd = req.fd
+            self.Readers [req.fd] = task
+            self.Poll.register (req.fd, select.POLLIN | select.POLLPRI)
+            if req.Timeout != None:
+                self.Schedule (task, req.Timeout, False)
+        elif isinstance (req, Sleep):
+            self.Schedule (task, req.Delay, None)
+        else:
+            # Yielding anything else just lets other tasks run
+            self.Ready.append ((task, None, None))
+
+
+    def Schedule (self, task, delay, value):
+        self.TimerSeq += 1
+        seq = task.TimerSeq = self.TimerSeq
+        heapq.heappush (self.Timers, (time.time () + max (delay, 0), seq,
+            lambda: self.Wakeup (task, seq, value)))
+
+
+    def Finish (self, task, result, error):
+        self.Unwait (task)
+        task.Done = True
+        task.Result = result
+        task.Error = error
+        task.Elapsed = time.time () - task.StartTime
+        self.Tasks.remove (task)
+
+
+    def RunOnce (self):
+        # Run everything that is ready
+        ready, self.Ready = self.Ready, []
+        for task, value, exc in ready:
+            if not task.Done:
+                self.Step (task, value, exc)
+
+        if self.Ready:
+            timeout = 0
+        elif self.Timers:
+            timeout = max (0, self.Timers [0][0] - time.time ())
+        else:
+            timeout = None
+
+        if self.Readers or (timeout != 0):
+            if timeout != None:
+                # poll () wants milliseconds, round up to avoid busy looping
+                timeout = int (timeout * 1000) + 1
+            for fd, ev in self.Poll.poll (timeout):
+                task = self.Readers.get (fd)
+                if task != None:
+                    self.Unwait (task)
+                    self.Ready.append ((task, True, None))
+
+        now = time.time ()
+        while self.Timers and (self.Timers [0][0] <= now):
+            deadline, seq, func = heapq.heappop (self.Timers)
+            func ()
+
+
+    def Run (self):
+        """Run the loop until all tasks finish"""
+        while self.Tasks:
+            self.RunOnce ()
+
+
+class SerialTransport:
+    """Non-blocking access to a serial port. Read () never waits,
+    wait for the port with Readable before reading."""
+
+    def __init__ (self, com_port, baudrate, stopbits):
+        try:
+            self.Serial = serial.Serial (com_port, baudrate, serial.EIGHTBITS,
+                serial.PARITY_NONE, stopbits, timeout = 0)
+        except serial.SerialException, e:
+            raise serial.SerialException (str (e).decode (locale.getpreferredencoding ()))
+
+
+    def fileno (self):
+        return self.Serial.fileno ()
+
+
+    def Read (self):
+        n = self.Serial.inWaiting ()
+        if n == 0:
+            return ''
+        return self.Serial.read (n)
+
+
+    def Write (self, data):
+        # 32 bytes always fit into the tty output buffer, so this won't block
+        self.Serial.write (data)
+
+
+    def Flush (self):
+        self.Serial.flushInput ()
+
+
+    def Close (self):
+        self.Serial.close ()
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+# Upload a profile to many controllers at once
+#
+
+import re
+import time
+import locale
+import threading
+from xpdm import comports, evloop
+
+# Per-port upload status
+FUS_PENDING = 0
+FUS_RUNNING = 1
+FUS_OK = 2
+FUS_CANCELLED = 3
+FUS_FAILED = 4
+
+FleetStatusDesc = [ _("Pending"), _("Running"), _("Success"), _("Cancelled"), _("Failed") ]
+# Machine-readable names for FUS_XXX, for logs and JSON output
+FleetStatusName = [ "pending", "running", "ok", "cancelled", "failed" ]
+
+
+def PortOrder (port):
+    """Sort key for serial port names, so that ttyUSB10 comes after ttyUSB9"""
+    m = re.match (r"(.*?)(\d*)$", port)
+    return (m.group (1), int (m.group (2) or -1))
+
+
+def ErrorText (e):
+    """Return the message of an exception as unicode. Upload errors are
+    usually translated, so str (e) fails on them with non-ASCII locales"""
+    if (len (e.args) == 1) and isinstance (e.args [0], basestring):
+        msg = e.args [0]
+    else:
+        try:
+            msg = str (e)
+        except UnicodeError:
+            msg = unicode (e)
+    if isinstance (msg, str):
+        msg = msg.decode (locale.getpreferredencoding (), 'replace')
+    return msg
+
+
+class PortUpload (threading.Thread):
+    """Upload a profile to a single serial port from a separate thread.
+    The Profile.Upload method blocks until the controller acknowledges the
+    data, so every port gets its own worker."""
+
+    def __init__ (self, prof, port, cancel, timeout = None, progress_func = None,
+                  handshake = None, cadence = 0.2, frame = None):
+        threading.Thread.__init__ (self, name = "upload:%s" % port)
+        self.setDaemon (True)
+        self.Profile = prof
+        self.Port = port
+        self.Cancel = cancel
+        self.Timeout = timeout
+        self.ProgressFunc = progress_func
+        self.Handshake = handshake
+        self.Cadence = cadence
+        self.Frame = frame
+        self.Status = FUS_PENDING
+        self.Message = None
+        self.Elapsed = 0.0
+        self.StartTime = None
+        self.TimedOut = False
+        # Current upload phase (one of infineon.UPH_XXX)
+        self.Phase = None
+
+
+    def run (self):
+        self.StartTime = time.time ()
+        self.Status = FUS_RUNNING
+        try:
+            ok = self.Profile.Upload (self.Port, self.Progress, self.Handshake, self.Cadence,
+                self.Frame)
+            self.Message = None
+            if ok:
+                self.Status = FUS_OK
+            else:
+                self.Status = FUS_CANCELLED
+                if self.TimedOut:
+                    self.Message = _("Timed out")
+        except Exception, e:
+            self.Status = FUS_FAILED
+            self.Message = ErrorText (e)
+        finally:
+            # The final report must always come, the GUI, the dashboard
+            # and the station release the port when they get it
+            if self.Status == FUS_RUNNING:
+                self.Status = FUS_FAILED
+            self.Elapsed = time.time () - self.StartTime
+            if self.ProgressFunc:
+                self.ProgressFunc (self, msg = self.Message)
+
+
+    def Progress (self, pos = None, msg = None, phase = None):
+        if msg != None:
+            self.Message = msg
+        if phase != None:
+            self.Phase = phase
+        if self.ProgressFunc:
+            self.ProgressFunc (self, pos = pos, msg = msg, phase = phase)
+
+        if self.Cancel.isSet ():
+            return False
+        if (self.Timeout != None) and (time.time () - self.StartTime > self.Timeout):
+            self.TimedOut = True
+            return False
+        return True
+
+
+class FleetUpload:
+    """Upload the same profile to every given serial port simultaneously.
+    If no port list is given, all ports returned by comports () are used.
+    The progress function, if given, is called from the worker threads
+    as progress_func (worker, pos = None, msg = None, phase = None).
+    If the profile is already encoded (e.g. taken from a frame bank),
+    pass the frame to avoid encoding it again."""
+
+    def __init__ (self, prof, ports = None, timeout = None, progress_func = None,
+                  handshake = None, cadence = 0.2, frame = None):
+        if ports is None:
+            ports = [port for order, port, desc, hwid in sorted (comports ())]
+
+        self.Profile = prof
+        self.CancelEvent = threading.Event ()
+        self.Workers = [PortUpload (prof, port, self.CancelEvent, timeout, progress_func,
+                                    handshake, cadence, frame) for port in ports]
+
+
+    def Start (self):
+        for w in self.Workers:
+            w.start ()
+
+
+    def Cancel (self):
+        self.CancelEvent.set ()
+
+
+    def Wait (self, timeout = None):
+        """Wait until all workers finish. Returns False if some workers
+        are still running after the given timeout"""
+        if timeout != None:
+            deadline = time.time () + timeout
+        for w in self.Workers:
+            if timeout is None:
+                # join() without timeout is not interruptible by Ctrl+C
+                while w.isAlive ():
+                    w.join (0.5)
+            else:
+                w.join (max (0, deadline - time.time ()))
+                if w.isAlive ():
+                    return False
+
+        return True
+
+
+    def Results (self):
+        """Return a list of (port, status, message, elapsed) tuples"""
+        return [(w.Port, w.Status, w.Message, w.Elapsed) for w in self.Workers]
+
+
+def Upload (prof, ports = None, timeout = None, progress_func = None,
+            handshake = None, cadence = 0.2, frame = None):
+    """Upload a profile to a number of serial ports at once and wait until
+    all uploads finish. Returns the same list as FleetUpload.Results ()"""
+    fleet = FleetUpload (prof, ports, timeout, progress_func, handshake, cadence, frame)
+    fleet.Start ()
+    try:
+        fleet.Wait ()
+    except KeyboardInterrupt:
+        fleet.Cancel ()
+        fleet.Wait ()
+
+    return fleet.Results ()
+
+
+def UploadAsync (prof, ports = None, timeout = None, cadence = 0.2, frame = None,
+                 progress_func = None):
+    """Same as Upload (), but all ports are driven by a single event loop
+    instead of a thread per port. POSIX only. The progress function, if
+    given, is called as progress_func (port, pos = None, msg = None,
+    phase = None). Returns a (results, interrupted) tuple, where
+    interrupted is True if the uploads were cancelled by Ctrl+C."""
+    if ports is None:
+        ports = [port for order, port, desc, hwid in sorted (comports ())]
+
+    tasks = []
+    loop = evloop.EventLoop ()
+    for port in ports:
+        func = None
+        if progress_func:
+            func = lambda pos = None, msg = None, phase = None, port = port: \
+                progress_func (port, pos, msg, phase)
+        tasks.append (loop.Spawn (prof.UploadAsync (port, cadence, func, frame), port, timeout))
+
+    interrupted = False
+    try:
+        loop.Run ()
+    except KeyboardInterrupt:
+        interrupted = True
+        for t in tasks:
+            t.Cancel ()
+        loop.Run ()
+
+    results = []
+    for t in tasks:
+        if t.Error != None:
+            results.append ((t.Name, FUS_FAILED, ErrorText (t.Error), t.Elapsed))
+        elif t.Result:
+            results.append ((t.Name, FUS_OK, None, t.Elapsed))
+        elif t.Cancelled and (timeout != None) and (t.Elapsed >= timeout):
+            results.append ((t.Name, FUS_CANCELLED, _("Timed out"), t.Elapsed))
+        else:
+            results.append ((t.Name, FUS_CANCELLED, None, t.Elapsed))
+
+    return results, interrupted
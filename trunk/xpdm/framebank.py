@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+# The frame bank: a file with the pre-encoded upload frames of a whole
+# profile library, looked up by profile content hash. Upload workers map
+# the file into memory and send the frames right from it, so nothing is
+# parsed or encoded per upload, and all processes share the same pages.
+#
+# File layout (all integers are little-endian):
+#   header  "XPDFBANK", version (uint32), frame count (uint32), frame size (uint32)
+#   index   count x (20-byte SHA-1 content hash, uint32 frame number), sorted by hash
+#   frames  count x frame size bytes
+#
+
+import os
+import mmap
+import struct
+from xpdm import FNENC
+
+MAGIC = "XPDFBANK"
+VERSION = 1
+HEADER = struct.Struct ("<8sIII")
+ENTRY = struct.Struct ("<20sI")
+
+
+def Build (fn, profs):
+    """Write the frames of given profiles to a frame bank file. Profiles
+    with the same content are stored once. Returns the number of frames."""
+    frames = {}
+    for prof in profs:
+        frames [prof.ContentHash ()] = prof.BuildFrame ()
+
+    keys = sorted (frames.keys ())
+    size = 0
+    if keys:
+        size = len (frames [keys [0]])
+
+    # Write to a temporary file first, since the old bank may be mapped
+    # by running workers; they will keep the old copy until reopened
+    tmpfn = (fn + ".tmp").encode (FNENC)
+    f = file (tmpfn, "wb")
+    try:
+        f.write (HEADER.pack (MAGIC, VERSION, len (keys), size))
+        for i in range (len (keys)):
+            f.write (ENTRY.pack (keys [i], i))
+        for k in keys:
+            if len (frames [k]) != size:
+                raise ValueError (_("All frames in a frame bank must be of the same size"))
+            f.write (frames [k])
+    finally:
+        f.close ()
+
+    if os.name == "nt" and os.access (fn.encode (FNENC), os.F_OK):
+        os.remove (fn.encode (FNENC))
+    os.rename (tmpfn, fn.encode (FNENC))
+    return len (keys)
+
+
+class FrameBank:
+    """Read-only access to a frame bank file"""
+
+    def __init__ (self, fn):
+        self.FileName = fn
+        f = file (fn.encode (FNENC), "rb")
+        try:
+            self.Map = mmap.mmap (f.fileno (), 0, access = mmap.ACCESS_READ)
+        finally:
+            f.close ()
+
+        if len (self.Map) < HEADER.size:
+            self.Close ()
+            raise ValueError (_("Not a frame bank file: %(fn)s") % { "fn" : fn })
+        magic, version, self.Count, self.FrameSize = HEADER.unpack_from (self.Map)
+        if (magic != MAGIC) or (version != VERSION) or \
+           (len (self.Map) != HEADER.size + self.Count * (ENTRY.size + self.FrameSize)):
+            self.Close ()
+            raise ValueError (_("Not a frame bank file: %(fn)s") % { "fn" : fn })
+        self.FramesOffset = HEADER.size + self.Count * ENTRY.size
+
+
+    def __len__ (self):
+        return self.Count
+
+
+    def Close (self):
+        self.Map.close ()
+
+
+    def Find (self, digest):
+        """Return the number of the frame with given content hash, or None"""
+        lo = 0
+        hi = self.Count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            ofs = HEADER.size + mid * ENTRY.size
+            key = self.Map [ofs:ofs + 20]
+            if key < digest:
+                lo = mid + 1
+            elif key > digest:
+                hi = mid
+            else:
+                return ENTRY.unpack_from (self.Map, ofs) [1]
+        return None
+
+
+    def Frame (self, digest):
+        """Return the frame (a str) with given content hash, or None"""
+        i = self.Find (digest)
+        if i is None:
+            return None
+        ofs = self.FramesOffset + i * self.FrameSize
+        return self.Map [ofs:ofs + self.FrameSize]
+
+
+    def Get (self, prof):
+        """Return the frame for given profile, or None if it's not in the bank"""
+        return self.Frame (prof.ContentHash ())
@@ -13,8 +13,9 @@ import glib
 import gio
 import pango
 import time
+import threading
 import locale
-from xpdm import VERSION, FNENC, comports, infineon, infineon2, infineon3
+from xpdm import VERSION, FNENC, PortWatcher, infineon, infineon2, infineon3, profindex, fleet, dashboard
 
 
 #-----------------------------------------------------------------------------
@@ -75,14 +76,31 @@ class Application:
 
         self.builder.connect_signals (self);
 
+        self.ProfileCache = profindex.ProfileCache ()
+        self.ProfileIndex = profindex.ProfileIndex (os.path.join (self.CONFIGDIR, "profiles.idx"),
+            self.ProfileCache)
+        self.IndexSaveTimer = None
+        self.ProfileScanner = None
+        self.Uploader = None
+        self.UploadCancel = threading.Event ()
+        self.Dashboard = None
+        # Serial ports being programmed, with the upload worker holding each
+        self.BusyPorts = {}
+
         self.InitProfileList ()
         self.LoadProfiles ()
+        self.WatchProfileDirs ()
         self.FillFamilies ()
 
-        # Dynamic serial port list update worker
-        self.SerialPortsHash = None
+        # Serial port list is updated as adapters are plugged in and out
+        self.PortWatcher = PortWatcher ()
+        self.PortWatcher.Subscribe (self.on_SerialPort_changed)
         self.UpdateSerialPorts ()
-        glib.timeout_add_seconds (1, self.RefreshSerialPorts)
+        if self.PortWatcher.fileno () != None:
+            glib.io_add_watch (self.PortWatcher.fileno (), glib.IO_IN, self.on_PortWatcher_ready)
+        else:
+            # No hotplug notifications, poll
+            glib.timeout_add_seconds (1, self.on_PortWatcher_ready)
 
         # Enable image buttons on Windows; on Linux you can change it via preferences
         if os.name == "nt":
@@ -91,7 +109,9 @@ class Application:
 
         self.MainWindow.show ()
 
-        self.SetStatus (_("Ready"))
+        # Otherwise the status is set when all profiles are loaded
+        if self.ProfileScanner is None:
+            self.SetStatus (_("Ready"))
 
 
 # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- #
@@ -141,33 +161,7 @@ class Application:
         self.ProfileListStore.set_sort_column_id (1, gtk.SORT_ASCENDING)
 
 
-    def RefreshSerialPorts (self):
-        if self.Dead:
-            return False
-        if self.ButtonCancelUpload.get_visible ():
-            return True
-
-        spl = []
-        sph = 0
-        for order, port, desc, hwid in sorted (comports ()):
-            spl.append (port)
-            sph += hash (port)
-
-        if (sph == self.SerialPortsHash):
-            return True
-
-        self.UpdateSerialPorts (spl, sph)
-        return True
-
-
-    def UpdateSerialPorts (self, spl=None, sph=None):
-        if spl is None:
-            spl = []
-            sph = 0
-            for order, port, desc, hwid in sorted (comports ()):
-                spl.append (port)
-                sph += hash (port)
-
+    def UpdateSerialPorts (self):
         store = self.SerialPortsList.get_model ()
         if store is None:
             selport = None
@@ -183,38 +177,85 @@ class Application:
         store.clear ()
         idx = 0
         act = 0
-        for port in spl:
+        for port in sorted (self.PortWatcher.Ports, key = fleet.PortOrder):
             store.append ([port])
             if selport == port:
                 act = idx
             idx += 1
         self.SerialPortsList.set_active (act)
-        self.SerialPortsHash = sph
 
         self.SetStatus (_("Serial ports list updated"))
 
 
-    def UpdateProgress (self, pos = None, msg = None):
-        if msg != None:
-            self.SetStatus (msg)
-        if pos == None:
-            self.ProgressBar.pulse ()
+    def on_SerialPort_changed (self, port, added):
+        # Only the row of the port that came or went is touched
+        if self.Dead:
+            return
+
+        store = self.SerialPortsList.get_model ()
+        if added:
+            idx = 0
+            while (idx < len (store)) and (fleet.PortOrder (store [idx][0]) < fleet.PortOrder (port)):
+                idx += 1
+            store.insert (idx, [port])
+            if self.SerialPortsList.get_active () < 0:
+                self.SerialPortsList.set_active (idx)
+        else:
+            for idx in range (len (store)):
+                if store [idx][0] == port:
+                    active = self.SerialPortsList.get_active () == idx
+                    store.remove (store.get_iter (idx))
+                    if active and len (store):
+                        self.SerialPortsList.set_active (0)
+                    break
+
+        # Don't hide the upload messages
+        if not self.ButtonCancelUpload.get_visible ():
+            self.SetStatus (_("Serial ports list updated"))
+
+
+    def on_PortWatcher_ready (self, *args):
+        if self.Dead:
+            return False
+        return self.PortWatcher.Dispatch ()
+
+
+    def UpdateProgress (self, worker, pos, msg, status):
+        # Called in the main thread for every progress report of the upload worker
+        if self.Dead or (worker is not self.Uploader):
+            return False
+
+        if status in (fleet.FUS_PENDING, fleet.FUS_RUNNING):
+            if msg != None:
+                self.SetStatus (msg)
+            if pos == None:
+                self.ProgressBar.pulse ()
+            else:
+                self.ProgressBar.set_fraction (pos)
+            return False
+
+        self.Uploader = None
+        self.BusyPorts.pop (worker.Port, None)
+        if status == fleet.FUS_OK:
+            self.SetStatus (_("Settings uploaded successfully"))
+        elif status == fleet.FUS_CANCELLED:
+            self.SetStatus (_("Upload cancelled"))
         else:
-            self.ProgressBar.set_fraction (pos)
-        while gtk.events_pending ():
-            gtk.main_iteration ()
+            self.SetStatus (_("Upload failed: %(msg)s") % { "msg" : worker.Message })
 
-        return not (self.UploadCancelled or self.Dead)
+        self.MainWindow.set_deletable (True)
+        self.ButtonCancelUpload.grab_remove ()
+        self.ButtonCancelUpload.hide ()
+        self.ProgressBar.hide ()
+        self.UserHints.hide ()
+        self.UserChoice.show ()
+        return False
 
 
-    def EditProfile (self, prof, oldsel=None):
+    def EditProfile (self, prof):
         if prof is None:
             return
 
-        if oldsel is None:
-            selected_prof = prof.Description [:]
-        else:
-            selected_prof = oldsel
         self.ProfileName.set_text (prof.Description)
         self.SelectFamily (prof.Family)
         prof.FillParameters (self.ParamVBox)
@@ -229,69 +270,191 @@ class Application:
         prof = self.ActiveProfile
         self.ActiveProfile = None
 
-        if ok:
-            # Rename profile, if profile name changed
-            try:
-                newname = self.ProfileName.get_text ().strip ()
-                if newname != prof.Description:
-                    prof.SetDescription (newname)
-                    selected_prof = newname [:]
-                    self.SetStatus (_("Profile renamed"))
-            except OSError, e:
-                self.Message (gtk.MESSAGE_ERROR, \
-                    _("Failed to rename profile %(desc)s:\n%(msg)s") % \
-                    { "desc" : prof.Description, "msg" : e })
-                self.SetStatus (_("Failed to rename profile"))
-
-            # Save profile, if we have enough access rights
-            try:
-                prof.Save ()
-                selected_prof = prof.Description [:]
-                self.SetStatus (_("Profile saved"))
-            except IOError, e:
-                self.Message (gtk.MESSAGE_ERROR, \
-                    _("Failed to save profile %(desc)s:\n%(msg)s") % \
-                    { "desc" : prof.Description, "msg" : e })
-                self.SetStatus (_("Failed to save profile"))
+        if not ok:
+            return
 
-        self.LoadProfiles (selected_prof)
+        # Rename profile, if profile name changed
+        try:
+            newname = self.ProfileName.get_text ().strip ()
+            if newname != prof.Description:
+                oldfn = prof.FileName.decode (FNENC)
+                prof.SetDescription (newname)
+                self.RemoveProfileRow (oldfn)
+                self.ProfileCache.Remove (oldfn)
+                self.SetStatus (_("Profile renamed"))
+        except OSError, e:
+            self.Message (gtk.MESSAGE_ERROR, \
+                _("Failed to rename profile %(desc)s:\n%(msg)s") % \
+                { "desc" : prof.Description, "msg" : e })
+            self.SetStatus (_("Failed to rename profile"))
+
+        # Save profile, if we have enough access rights
+        fn = prof.FileName.decode (FNENC)
+        try:
+            prof.Save ()
+            self.SetStatus (_("Profile saved"))
+            saved = True
+        except IOError, e:
+            self.Message (gtk.MESSAGE_ERROR, \
+                _("Failed to save profile %(desc)s:\n%(msg)s") % \
+                { "desc" : prof.Description, "msg" : e })
+            self.SetStatus (_("Failed to save profile"))
+            saved = False
+
+        # The file may be rewritten within the same second, don't trust mtime
+        self.ProfileCache.Remove (fn)
+        if saved:
+            # The saved profile is at hand, no need to parse the file again
+            if self.ProfileScanner != None:
+                self.ProfileScanSkip.add (fn)
+            self.ProfileIndex.Put (fn, prof)
+            i = self.SetProfileRow (fn, (prof.Family, prof.GetModel (), prof.Description))
+        else:
+            i = self.UpdateProfileRow (fn)
+        if i != None:
+            self.ProfileList.get_selection ().select_iter (i)
 
 
-    def LoadProfiles (self, sel=None):
-        # Remember the old selection, before re-filling the list
-        model = self.ProfileList.get_model ()
-        if not sel:
-            sel = self.ProfileList.get_selection ().get_selected () [1]
-            if sel:
-                sel = model [sel] [2]
+    def LoadProfiles (self):
+        """Fill the profile list in background: the files are parsed
+        in a separate thread, and rows are added as they come in"""
+        if self.ProfileScanner != None:
+            self.ProfileScanner.Cancel ()
 
         self.ProfileListStore.clear ()
+        self.ProfileRows = {}
+        # Files changed while scanning, the scanner results for them are stale
+        self.ProfileScanSkip = set ()
+        self.ProfileScanErrors = []
+
         # Python bug: glob() with unicode argument will use locale.getpreferredencoding()
         # for file name encoding, which is not compatible with glib filename encodings
-        for x in glob.glob (os.path.join (self.DATADIR.encode (FNENC), "*.asv")) + \
-                 glob.glob (os.path.join (self.CONFIGDIR.encode (FNENC), "*.asv")):
+        files = [x.decode (FNENC) for x in \
+                 glob.glob (os.path.join (self.DATADIR.encode (FNENC), "*.asv")) + \
+                 glob.glob (os.path.join (self.CONFIGDIR.encode (FNENC), "*.asv"))]
+
+        # Only new and changed files are actually parsed
+        self.ProfileScanner = profindex.ProfileScanner (self.ProfileIndex, files,
+            lambda *args: glib.idle_add (self.ProfilesScanned, *args))
+        self.ProfileScanner.start ()
+        self.SetStatus (_("Loading profiles: %(done)d/%(total)d") % \
+            { "done" : 0, "total" : len (files) })
+
+
+    def ProfilesScanned (self, scanner, rows, done, total):
+        # Called in the main thread for every chunk of scanned files
+        if self.Dead or (scanner is not self.ProfileScanner):
+            return False
+
+        for fn, ent, err in rows:
+            if fn in self.ProfileScanSkip:
+                continue
+            if err != None:
+                self.ProfileScanErrors.append (self.LoadErrorMessage (fn, err))
+            if ent != None:
+                self.SetProfileRow (fn, ent)
+
+        if done < total:
+            self.SetStatus (_("Loading profiles: %(done)d/%(total)d") % \
+                { "done" : done, "total" : total })
+            return False
+
+        self.ProfileScanner = None
+        # Also keeps the files that were added by the monitor meanwhile
+        self.ProfileIndex.Prune (self.ProfileRows.keys ())
+        self.SaveProfileIndex ()
+        self.SetStatus (_("Ready"))
+
+        if self.ProfileScanErrors:
+            self.Message (gtk.MESSAGE_WARNING, "\n\n".join (self.ProfileScanErrors))
+            self.ProfileScanErrors = []
+        return False
+
+
+    def LoadErrorMessage (self, fn, e):
+        if isinstance (e, IOError):
+            msg = unicode (e.strerror, locale.getpreferredencoding(), 'replace')
+        else:
+            msg = e
+        return _("Failed to load profile %(fn)s:\n%(msg)s") % { "fn" : fn, "msg" : msg }
+
+
+    def UpdateProfileRow (self, fn, quiet = False):
+        """Add, refresh or remove the list row of a single profile file.
+        Returns the row iterator, or None if fn is not a valid profile.
+        If quiet is True, load errors are not reported to the user."""
+        if self.ProfileScanner != None:
+            self.ProfileScanSkip.add (fn)
+
+        ent = None
+        try:
+            ent = self.ProfileIndex.Scan (fn)
+        except (IOError, ValueError), e:
+            if not quiet:
+                self.Message (gtk.MESSAGE_WARNING, self.LoadErrorMessage (fn, e))
+
+        if ent is None:
+            self.RemoveProfileRow (fn)
+            return None
+
+        return self.SetProfileRow (fn, ent)
+
+
+    def SetProfileRow (self, fn, ent):
+        row = ent + (fn,)
+        ref = self.ProfileRows.get (fn)
+        if (ref != None) and ref.valid ():
+            self.ProfileListStore [ref.get_path ()] = row
+            i = self.ProfileListStore.get_iter (ref.get_path ())
+        else:
+            i = self.ProfileListStore.append (row)
+            self.ProfileRows [fn] = gtk.TreeRowReference (self.ProfileListStore,
+                self.ProfileListStore.get_path (i))
+
+        self.ScheduleIndexSave ()
+        return i
+
+
+    def RemoveProfileRow (self, fn):
+        if self.ProfileScanner != None:
+            self.ProfileScanSkip.add (fn)
+        self.ProfileCache.Remove (fn)
+        ref = self.ProfileRows.pop (fn, None)
+        if (ref != None) and ref.valid ():
+            self.ProfileListStore.remove (self.ProfileListStore.get_iter (ref.get_path ()))
+        self.ProfileIndex.Remove (fn)
+        self.ScheduleIndexSave ()
+
+
+    def ScheduleIndexSave (self):
+        # Batch index writes, provisioning scripts may drop many files at once
+        if self.IndexSaveTimer is None:
+            self.IndexSaveTimer = glib.timeout_add_seconds (2, self.SaveProfileIndex)
+
+
+    def SaveProfileIndex (self):
+        if self.IndexSaveTimer != None:
+            glib.source_remove (self.IndexSaveTimer)
+            self.IndexSaveTimer = None
+        try:
+            self.ProfileIndex.Save ()
+        except (IOError, OSError):
+            # Not fatal, we'll just have to parse everything next time
+            pass
+        return False
+
+
+    def WatchProfileDirs (self):
+        self.ProfileMonitors = []
+        for d in self.DATADIR, self.CONFIGDIR:
             try:
-                prof = self.LoadProfile (x.decode (FNENC))
-                self.ProfileListStore.append ( \
-                    (prof.Family, prof.GetModel (), prof.Description,
-                     prof.FileName.decode (FNENC)))
-            except IOError, e:
-                self.Message (gtk.MESSAGE_WARNING, \
-                    _("Failed to load profile %(fn)s:\n%(msg)s") % \
-                    { "fn" : x, "msg" : unicode (e.strerror, locale.getpreferredencoding(), 'replace') })
-            except ValueError, e:
-                self.Message (gtk.MESSAGE_WARNING, \
-                    _("Failed to load profile %(fn)s:\n%(msg)s") % \
-                    { "fn" : x, "msg" : e })
-
-        # Re-select previously selected profile
-        if sel:
-            i = model.get_iter_first ()
-            while i:
-                if model [i] [2] == sel:
-                    self.ProfileList.get_selection ().select_iter (i)
-                    break
-                i = model.iter_next (i)
+                mon = gio.File (d.encode (FNENC)).monitor_directory (gio.FILE_MONITOR_SEND_MOVED)
+            except gio.Error:
+                # No live updates then, the list is still filled on startup
+                continue
+            mon.connect ("changed", self.on_ProfileDir_changed, d)
+            self.ProfileMonitors.append (mon)
+
 
     def FillFamilies (self):
         store = gtk.ListStore (str)
@@ -315,18 +478,8 @@ class Application:
 
 
     def LoadProfile (self, fn):
-        f = file (fn.encode (FNENC), "r")
-        l = f.readlines ()
-        prof = None
-        for fam in infineon.Families:
-            if fam [2] (l):
-                prof = fam [1] (fam [0], fn)
-                break
-
-        if prof != None:
-            prof.Load (fn, l)
-
-        return prof
+        # The returned profile is shared with the cache, copy before changing
+        return self.ProfileCache.Load (fn)
 
 
     def GetSelectedProfile (self):
@@ -352,12 +505,21 @@ class Application:
 
     def on_MainWindow_destroy (self, win):
         self.Dead = True
-        self.UploadCancelled = True
+        self.UploadCancel.set ()
+        if self.Dashboard != None:
+            self.Dashboard.Close ()
+        if self.ProfileScanner != None:
+            self.ProfileScanner.Cancel ()
+        self.SaveProfileIndex ()
+
+        # Don't let the workers die in the middle of writing a frame
+        for worker in self.BusyPorts.values ():
+            worker.join ()
         gtk.main_quit ()
 
 
     def on_ButtonCancelUpload_clicked (self, but):
-        self.UploadCancelled = True
+        self.UploadCancel.set ()
 
 
     def on_ButtonApply_clicked (self, but):
@@ -370,7 +532,11 @@ class Application:
             self.SetStatus (_("No serial port selected"))
             return
 
-        self.UploadCancelled = False
+        if self.BusyPorts.has_key (serport):
+            self.SetStatus (_("Serial port %(port)s is busy") % { "port" : serport })
+            return
+
+        self.UploadCancel.clear ()
         self.SetStatus (_("Uploading settings to controller"))
         self.UserChoice.hide ()
         self.UserHints.show ()
@@ -379,9 +545,6 @@ class Application:
         self.ButtonCancelUpload.grab_add ()
         self.MainWindow.set_deletable (False)
 
-        while gtk.events_pending ():
-            gtk.main_iteration ()
-
         self.UserHints.set_label (_("""\
 Applying profile: <b>%(prof)s</b>
 Controller model: <b>%(ctrl)s</b>
@@ -399,37 +562,28 @@ to the cable button) you will need to completely disconnect temporarily either \
 the controller from the cable, or the cable from the USB port.\
 """) % { "prof" : prof.Description, "ctrl" : prof.GetModel (), "port" : serport })
 
-        msg = None
-        try:
-            ok = prof.Upload (serport, self.UpdateProgress)
-            if ok:
-                self.SetStatus (_("Settings uploaded successfully"))
-            else:
-                self.SetStatus (_("Upload cancelled"))
-
-        except Exception, e:
-            msg = str (e)
-
-        if msg != None:
-            self.SetStatus (_("Upload failed: %(msg)s") % { "msg" : str (e) })
-
-        self.MainWindow.set_deletable (True)
-        self.ButtonCancelUpload.grab_remove ()
-        self.ButtonCancelUpload.hide ()
-        self.ProgressBar.hide ()
-        self.UserHints.hide ()
-        self.UserChoice.show ()
+        # The upload runs in its own thread, so that GUI redraws can't delay
+        # the handshake; progress is passed back through the main loop
+        self.Uploader = fleet.PortUpload (prof, serport, self.UploadCancel,
+            progress_func = lambda worker, pos = None, msg = None, phase = None: \
+                glib.idle_add (self.UpdateProgress, worker, pos, msg, worker.Status))
+        self.BusyPorts [serport] = self.Uploader
+        self.Uploader.start ()
 
 
     def on_ButtonEdit_clicked (self, but):
-        self.EditProfile (self.LoadSelectedProfile ())
+        prof = self.LoadSelectedProfile ()
+        if prof is None:
+            return
+
+        self.EditProfile (copy.copy (prof))
 
 
     def on_ButtonCreate_clicked (self, but):
         prof = infineon.Families [0][1] ( \
             infineon.Families [0][0], os.path.join (self.CONFIGDIR, _("New profile").decode ("utf-8")))
         prof.SetDescription (prof.Description)
-        self.EditProfile (prof, self.GetSelectedProfile ())
+        self.EditProfile (prof)
 
 
     def on_ButtonCopy_clicked (self, but):
@@ -437,9 +591,10 @@ the controller from the cable, or the cable from the USB port.\
         if prof is None:
             return
 
+        prof = copy.copy (prof)
         prof.SetFileName (os.path.join (self.CONFIGDIR, _("New ").decode ("utf-8") + \
             prof.Description + ".asv"), False)
-        self.EditProfile (prof, self.GetSelectedProfile ())
+        self.EditProfile (prof)
 
 
     def on_ButtonDelete_clicked (self, but):
@@ -453,7 +608,7 @@ the controller from the cable, or the cable from the USB port.\
         if rc == gtk.RESPONSE_OK:
             try:
                 prof.Remove ()
-                self.LoadProfiles ()
+                self.RemoveProfileRow (prof.FileName.decode (FNENC))
                 self.SetStatus (_("Profile deleted"))
             except:
                 self.Message (gtk.MESSAGE_ERROR, \
@@ -462,12 +617,44 @@ the controller from the cable, or the cable from the USB port.\
                 self.SetStatus (_("Failed to delete profile"))
 
 
+    def on_ButtonFleet_clicked (self, but):
+        if self.Dashboard is None:
+            self.Dashboard = dashboard.Dashboard (self)
+        self.Dashboard.Window.present ()
+
+
     def on_ButtonAbout_clicked (self, but):
         self.AboutDialog.set_version (VERSION)
         self.AboutDialog.run ()
         self.AboutDialog.hide ()
 
 
+    def on_ProfileDir_changed (self, monitor, gfile, other, event, d):
+        if self.Dead:
+            return
+
+        fn = os.path.join (d, gfile.get_basename ().decode (FNENC))
+
+        # Renames within the directory come as a single MOVED event
+        if event in (gio.FILE_MONITOR_EVENT_DELETED, gio.FILE_MONITOR_EVENT_MOVED):
+            if fn.endswith (".asv"):
+                self.RemoveProfileRow (fn)
+            if event != gio.FILE_MONITOR_EVENT_MOVED:
+                return
+            d = other.get_parent ().get_path ().decode (FNENC)
+            if d not in (self.DATADIR, self.CONFIGDIR):
+                return
+            fn = os.path.join (d, other.get_basename ().decode (FNENC))
+        elif event not in (gio.FILE_MONITOR_EVENT_CREATED, gio.FILE_MONITOR_EVENT_CHANGES_DONE_HINT):
+            return
+
+        # A file being written may be incomplete, it is re-read
+        # on CHANGES_DONE_HINT
+        if fn.endswith (".asv"):
+            self.ProfileCache.Remove (fn)
+            self.UpdateProfileRow (fn, True)
+
+
     def on_ControllerFamily_changed (self, cb):
         if self.ActiveProfile is None:
             return
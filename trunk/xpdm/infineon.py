@@ -3,27 +3,120 @@
 #
 
 import os
-import gtk
 import ctypes
 import math
-from xpdm import FNENC
+import hashlib
+import time
+import select
+import locale
+import serial
+from xpdm import FNENC, evloop
 
 # Parameter widget types for editing
 PWT_COMBOBOX = 0
 PWT_SPINBUTTON = 1
 
+# Controller handshake modes for Upload ()
+# Read the serial port with a timeout (works everywhere)
+HSM_POLL = 0
+# Wait for data readiness on the port file descriptor (POSIX only)
+HSM_SELECT = 1
+
+# Upload phases, reported to progress_func (phase = ...) when they begin
+# Opening the serial port
+UPH_OPEN = 0
+# Sending '8's and waiting for the 'U' reply
+UPH_WAIT_READY = 1
+# Sending the data frame
+UPH_SEND = 2
+# Waiting for the controller to acknowledge the data
+UPH_WAIT_ACK = 3
+
+UploadPhaseDesc = [ _("Opening serial port"), _("Waiting for controller ready"),
+    _("Sending data"), _("Waiting acknowledgement") ]
+
+if os.name == "nt":
+    DefaultHandshake = HSM_POLL
+else:
+    DefaultHandshake = HSM_SELECT
+
 # A list of controller families
 Families = []
-
-
-def RegisterFamily (Family, Profile, Models, DetectFormat):
-    Families.append ([Family, Profile, Models, DetectFormat])
-
-
-class Profile:
-    Family = None
-    FileName = None
-    Description = None
+# Model name prefix -> list of families, for SniffFamily ()
+FamilyPrefixes = {}
+# Families registered without a model prefix are tried on every file
+FamiliesNoPrefix = []
+# All different prefix lengths in FamilyPrefixes
+PrefixLengths = []
+
+
+def RegisterFamily (Family, Profile, DetectFormat, Models, Prefix = None):
+    """Register a controller family. DetectFormat (lines) checks whether
+    a .asv file given as a list of lines belongs to this family. If all
+    model names of the family start with Prefix, the detector is called
+    only for files which have a model name starting with it."""
+    fam = [Family, Profile, DetectFormat, Models]
+    Families.append (fam)
+    if Prefix is None:
+        FamiliesNoPrefix.append (fam)
+    else:
+        FamilyPrefixes.setdefault (Prefix, []).append (fam)
+        if len (Prefix) not in PrefixLengths:
+            PrefixLengths.append (len (Prefix))
+
+
+def SniffFamily (lines):
+    """Return the Families entry for a .asv file given as a list of lines,
+    or None if the format is not recognized"""
+    if not lines:
+        return None
+
+    # Controller type line may have the model name after a colon
+    i = lines [0].find (':')
+    if i < 0:
+        # No model name, only the detectors can tell
+        cands = Families
+    else:
+        model = lines [0][i + 1:]
+        cands = []
+        for n in PrefixLengths:
+            cands.extend (FamilyPrefixes.get (model [:n], ()))
+        if FamiliesNoPrefix:
+            # Keep the order of registration
+            cands = [fam for fam in Families if (fam in cands) or (fam in FamiliesNoPrefix)]
+
+    for fam in cands:
+        if fam [2] (lines):
+            return fam
+    return None
+
+
+def LoadProfile (fn):
+    """Load a profile from a .asv file, detecting the controller family.
+    Returns None if the file format is not recognized."""
+    f = file (fn.encode (FNENC), "r")
+    l = f.readlines ()
+    f.close ()
+
+    prof = None
+    fam = SniffFamily (l)
+    if fam != None:
+        prof = fam [1] (fam [0], fn)
+
+    if prof != None:
+        prof.Load (fn, l)
+
+    return prof
+
+
+class Profile (object):
+    # Instances have no __dict__ to save memory, families add a slot
+    # for every parameter in ParamLoadOrder
+    __slots__ = ("Family", "FileName", "Description", "Digest", "FrameCache", "EditWidgets")
+
+    # Controller type and parameter descriptions of the family
+    ControllerTypeDesc = []
+    ControllerParameters = {}
 
     # Parameter order when loading from .asv files
     ParamLoadOrder = []
@@ -34,14 +127,45 @@ class Profile:
     # The order of parameters in raw binary data sent to controller
     ParamRawOrder = []
 
+    # The compiled FrameEncoder and the FrameDecoder for this family, if any
+    Encoder = None
+    Decoder = None
+    # The compiled AsvCodec for this family, if any
+    Codec = None
 
-    def __init__ (self, Family, FileName, ControllerTypeDesc, ControllerParameters):
-        self.ControllerTypeDesc = ControllerTypeDesc
-        self.ControllerParameters = ControllerParameters
+    # Serial port settings used to talk to the controller
+    BaudRate = 9600
+    StopBits = serial.STOPBITS_ONE
+
+    # The reply sent by controller after it accepts the uploaded data
+    UploadAck = 'U'
+    # The reply sent by controller when uploaded data is broken, if any
+    UploadNak = None
+
+
+    def __init__ (self, Family, FileName):
+        self.FileName = None
         self.SetFileName (FileName)
         self.Family = Family
         for parm, desc in self.ControllerParameters.items ():
-            setattr (self, parm, desc ["Default"])
+            object.__setattr__ (self, parm, desc ["Default"])
+        self.Invalidate ()
+
+
+    def __setattr__ (self, name, value):
+        object.__setattr__ (self, name, value)
+        # Everything beyond the base slots is a parameter, and a stale
+        # frame must never reach the controller
+        if name not in Profile.__slots__:
+            object.__setattr__ (self, "Digest", None)
+            object.__setattr__ (self, "FrameCache", None)
+
+
+    def Invalidate (self):
+        """Forget the cached content hash and upload frame. Setting a
+        parameter does this automatically."""
+        self.Digest = None
+        self.FrameCache = None
 
 
     def SetFileName (self, fn, rename = True):
@@ -63,6 +187,14 @@ class Profile:
 
 
     def Load (self, fn, lines):
+        if self.Codec != None:
+            try:
+                self.Codec.Load (self, lines)
+            finally:
+                # AsvCodec.Load () stores the values past __setattr__
+                self.Invalidate ()
+            return
+
         vi = 0
         for l in lines:
             # Remove extra shit from the string
@@ -89,6 +221,17 @@ class Profile:
 
 
     def Save (self):
+        if self.Codec != None:
+            data = self.Codec.Format (self)
+        else:
+            data = self.FormatGeneric ()
+
+        f = open (self.FileName, "wb")
+        f.write (data)
+        f.close ()
+
+
+    def FormatGeneric (self):
         lines = []
         for parm in self.ParamLoadOrder:
             desc = self.ControllerParameters [parm]
@@ -108,9 +251,7 @@ class Profile:
             # Append a CR since the file uses windows line endings
             lines [-1] += '\r'
 
-        f = open (self.FileName, "wb")
-        f.write ('\n'.join (lines) + '\n')
-        f.close ()
+        return '\n'.join (lines) + '\n'
 
 
     def GetController (self):
@@ -127,12 +268,26 @@ class Profile:
         return "???"
 
 
+    def ContentHash (self):
+        """Return the SHA-1 digest of the family and all parameter values.
+        Profiles with the same digest produce the same upload frame."""
+        if self.Digest is None:
+            h = hashlib.sha1 (self.__class__.__module__)
+            for parm in self.ParamLoadOrder:
+                h.update (":%r" % float (getattr (self, parm)))
+            self.Digest = h.digest ()
+        return self.Digest
+
+
     def Remove (self):
         if self.FileName:
             os.remove (self.FileName)
 
 
     def FillParameters (self, vbox):
+        # Imported here so that the non-GUI parts work without PyGTK
+        import gtk
+
         rowcidx = 0
         rowcolors = [ gtk.gdk.Color (1.0, 1.0, 1.0), gtk.gdk.Color (1.0, 0.94, 0.86) ]
 
@@ -205,11 +360,12 @@ class Profile:
 
 
     def SpinButtonOutput (self, spin, parm, desc):
-        desc = self.ControllerParameters [parm]
-        if desc.get ("Units") is None:
-            mask = "%%.%df" % desc.get ("Precision", 1)
-        else:
-            mask = "%%.%df %s" % (desc.get ("Precision", 1), desc.get ("Units", "").replace ('%', '%%'))
+        mask = desc.get ("DisplayMask")
+        if mask is None:
+            if desc.get ("Units") is None:
+                mask = "%%.%df" % desc.get ("Precision", 1)
+            else:
+                mask = "%%.%df %s" % (desc.get ("Precision", 1), desc.get ("Units", "").replace ('%', '%%'))
         spin.set_text (mask % desc ["GetDisplay"] (self, spin.props.adjustment.value))
         return True
 
@@ -242,7 +398,20 @@ class Profile:
         setattr (self, parm, val)
 
 
+    def BuildFrame (self):
+        """Return the raw data frame as an immutable string. The frame is
+        cached against the content hash, so all uploads of an unchanged
+        profile share the same frame."""
+        digest = self.ContentHash ()
+        if (self.FrameCache is None) or (self.FrameCache [0] != digest):
+            self.FrameCache = (digest, str (self.BuildRaw ()))
+        return self.FrameCache [1]
+
+
     def BuildRaw (self):
+        if self.Encoder != None:
+            return self.Encoder.Encode (self)
+
         data = bytearray ()
 
         for x in self.ParamRawOrder:
@@ -272,3 +441,530 @@ class Profile:
         for parm in self.ControllerParameters.keys ():
             if hasattr (other, parm):
                 setattr (self, parm, getattr (other, parm))
+
+
+    def Upload (self, com_port, progress_func, handshake = None, cadence = 0.2, frame = None):
+        """Upload the profile into the controller connected to given serial port.
+        While waiting for the controller, a '8' is sent every 'cadence' seconds.
+        progress_func is called periodically, and it should return False to
+        cancel the upload. It is also called with the phase argument when
+        a new upload phase (UPH_XXX) begins. If the profile was encoded
+        beforehand (e.g. it comes from a frame bank), pass it as frame."""
+        if frame is None:
+            data = self.BuildFrame ()
+        else:
+            data = frame
+
+        if handshake is None:
+            handshake = DefaultHandshake
+
+        progress_func (phase = UPH_OPEN)
+        try:
+            ser = serial.Serial (com_port, self.BaudRate, serial.EIGHTBITS, serial.PARITY_NONE,
+                self.StopBits, timeout = cadence)
+        except serial.SerialException, e:
+            raise serial.SerialException (str (e).decode (locale.getpreferredencoding ()))
+
+        try:
+            progress_func (msg = _("Waiting for controller ready"), phase = UPH_WAIT_READY)
+            if handshake == HSM_SELECT:
+                ok = self.WaitReadySelect (ser, progress_func, cadence)
+            else:
+                ok = self.WaitReadyPoll (ser, progress_func)
+            if not ok:
+                return False
+
+            progress_func (phase = UPH_SEND)
+            ser.flushInput ()
+            ser.write (str (data))
+            progress_func (msg = _("Waiting acknowledgement"), phase = UPH_WAIT_ACK)
+            return self.WaitAck (ser, progress_func, handshake, cadence)
+        finally:
+            ser.close ()
+
+
+    def WaitReadyPoll (self, ser, progress_func):
+        # Send '8's and wait for the 'U' response
+        skip_write = False
+        while True:
+            if not skip_write:
+                # Garbage often comes from the controller upon bootup, just ignore it
+                ser.flushInput ()
+                ser.write ('8')
+            skip_write = False
+
+            c = ser.read ()
+            if c == 'U':
+                return True
+
+            if len (c) > 0:
+                skip_write = True
+
+            if not progress_func ():
+                return False
+
+
+    def WaitReadySelect (self, ser, progress_func, cadence):
+        # Send a '8' every 'cadence' seconds and wake up as soon as anything
+        # arrives, rather than waiting for a read timeout to expire
+        fd = ser.fileno ()
+        next_write = 0
+        while True:
+            now = time.time ()
+            if now >= next_write:
+                # Don't lose a 'U' that arrived right before the next '8',
+                # everything else is garbage from controller bootup
+                n = ser.inWaiting ()
+                if (n > 0) and ('U' in ser.read (n)):
+                    return True
+                ser.write ('8')
+                next_write = now + cadence
+
+            r, w, x = select.select ([fd], [], [], max (0, next_write - time.time ()))
+            if r:
+                n = ser.inWaiting ()
+                if 'U' in ser.read (max (n, 1)):
+                    return True
+
+            if not progress_func ():
+                return False
+
+
+    def WaitAck (self, ser, progress_func, handshake, cadence):
+        ack = self.UploadAck
+        while True:
+            if handshake == HSM_SELECT:
+                c = ''
+                r, w, x = select.select ([ser.fileno ()], [], [], cadence)
+                if r:
+                    c = ser.read (max (ser.inWaiting (), 1))
+            else:
+                c = ser.read ()
+
+            while len (c) and (c [0] == ack [0]):
+                c = c [1:]
+                ack = ack [1:]
+                if len (ack) == 0:
+                    return True
+
+            if len (c) > 0:
+                if c [0] == self.UploadNak:
+                    raise Exception (_("Controller says received data is broken"))
+                raise Exception (_("Invalid reply byte '%(chr)02x'") % { "chr" : ord (c [0]) })
+
+            if not progress_func ():
+                return False
+
+
+    def UploadAsync (self, com_port, cadence = 0.2, progress_func = None, frame = None):
+        """A coroutine for evloop.EventLoop that does the same as Upload ().
+        It finishes with True once the controller acknowledges the data;
+        cancel the task to abort the upload. progress_func, if given, is
+        only used to report status messages and upload phases."""
+        if progress_func is None:
+            progress_func = lambda pos = None, msg = None, phase = None: True
+
+        if frame is None:
+            frame = self.BuildFrame ()
+        data = str (frame)
+        progress_func (phase = UPH_OPEN)
+        port = evloop.SerialTransport (com_port, self.BaudRate, self.StopBits)
+
+        try:
+            progress_func (msg = _("Waiting for controller ready"), phase = UPH_WAIT_READY)
+            # Send a '8' every 'cadence' seconds until we get a 'U'
+            next_write = 0
+            while True:
+                now = time.time ()
+                if now >= next_write:
+                    if 'U' in port.Read ():
+                        break
+                    port.Write ('8')
+                    next_write = now + cadence
+
+                if (yield evloop.Readable (port, next_write - time.time ())):
+                    if 'U' in port.Read ():
+                        break
+
+            progress_func (phase = UPH_SEND)
+            port.Flush ()
+            port.Write (data)
+            progress_func (msg = _("Waiting acknowledgement"), phase = UPH_WAIT_ACK)
+
+            ack = self.UploadAck
+            while True:
+                yield evloop.Readable (port)
+                c = port.Read ()
+                while len (c) and (c [0] == ack [0]):
+                    c = c [1:]
+                    ack = ack [1:]
+                    if len (ack) == 0:
+                        raise evloop.Return (True)
+
+                if len (c) > 0:
+                    if c [0] == self.UploadNak:
+                        raise Exception (_("Controller says received data is broken"))
+                    raise Exception (_("Invalid reply byte '%(chr)02x'") % { "chr" : ord (c [0]) })
+        finally:
+            port.Close ()
+
+
+class TableProfile:
+    """Just enough of a Profile for the parameter conversion functions"""
+    def __init__ (self, ControllerTypeDesc, ControllerType):
+        self.ControllerTypeDesc = ControllerTypeDesc
+        self.ControllerType = ControllerType
+
+    GetController = Profile.GetController.im_func
+
+
+def CompileTables (ControllerTypeDesc, ControllerParameters):
+    """Precompute the GetDisplay and SetDisplay results of every spin button
+    parameter depending on controller type, for all raw values (0-255) and
+    every controller type, and replace the functions by table lookups.
+    The original functions are kept as GetDisplayFunc and SetDisplayFunc,
+    and are used for the values missing from the tables."""
+    for parm, desc in ControllerParameters.items ():
+        # Plain arithmetic is faster than any lookup, so only parameters
+        # going through GetController () are worth it
+        if (desc ["Widget"] != PWT_SPINBUTTON) or desc.has_key ("GetDisplayFunc") or \
+           ("ControllerType" not in desc.get ("Depends", [])):
+            continue
+
+        getf = desc ["GetDisplay"]
+        setf = desc ["SetDisplay"]
+        prec = math.pow (10, desc.get ("Precision", 1))
+
+        fwd = {}
+        inv = {}
+        for ct in range (1, len (ControllerTypeDesc) + 1):
+            prof = TableProfile (ControllerTypeDesc, ct)
+            fwd [ct] = {}
+            inv [ct] = {}
+            for raw in range (256):
+                val = getf (prof, float (raw))
+                fwd [ct][raw] = val
+                # Displayed values are rounded like SpinButtonValueChanged () does
+                val = round (val * prec) / prec
+                inv [ct][val] = setf (prof, val)
+
+        desc ["GetDisplayFunc"] = getf
+        desc ["SetDisplayFunc"] = setf
+        desc ["GetDisplay"] = MakeGetDisplay (getf, fwd)
+        desc ["SetDisplay"] = MakeSetDisplay (setf, inv)
+
+    # Spin button text formats
+    for parm, desc in ControllerParameters.items ():
+        if desc ["Widget"] != PWT_SPINBUTTON:
+            continue
+        if desc.get ("Units") is None:
+            desc ["DisplayMask"] = "%%.%df" % desc.get ("Precision", 1)
+        else:
+            desc ["DisplayMask"] = "%%.%df %s" % (desc.get ("Precision", 1),
+                desc ["Units"].replace ('%', '%%'))
+
+
+def MakeGetDisplay (getf, fwd):
+    floattype = float
+    def GetDisplay (prof, v):
+        # Spin buttons always give us floats; integer arguments go to the
+        # original function, in case it does integer division
+        if v.__class__ is floattype:
+            try:
+                return fwd [prof.ControllerType][v]
+            except KeyError:
+                pass
+        return getf (prof, v)
+    return GetDisplay
+
+
+def MakeSetDisplay (setf, inv):
+    def SetDisplay (prof, v):
+        try:
+            tab = inv [prof.ControllerType]
+        except KeyError:
+            # Unknown controller types use the first type, like GetController ()
+            tab = inv [1]
+        if v in tab:
+            return tab [v]
+        return setf (prof, v)
+    return SetDisplay
+
+
+class FrameEncoder:
+    """Builds the raw data frames of a controller family. The ParamRawOrder
+    layout is compiled once into a Python function which computes every
+    byte and the checksum in one go, instead of interpreting the layout
+    on every call like the generic Profile.BuildRaw () does."""
+
+    def __init__ (self, ParamRawOrder, ControllerTypeDesc, ControllerParameters):
+        ns = { "bytearray" : bytearray, "int" : int, "round" : round }
+        code = [ "def Encode (prof):" ]
+        items = []
+        const = 0
+        for i in range (len (ParamRawOrder)):
+            x = ParamRawOrder [i]
+            if type (x) != str:
+                items.append ("%d" % int (x))
+                const ^= int (x)
+                continue
+
+            desc = ControllerParameters [x]
+            if desc.has_key ("ToRaw"):
+                ns ["f%d" % i] = desc ["ToRaw"]
+                expr = "int (f%d (prof, prof.%s))" % (i, x)
+            elif desc ["Widget"] == PWT_COMBOBOX:
+                expr = "int (round (prof.%s))" % x
+            elif desc ["Widget"] == PWT_SPINBUTTON:
+                ns ["f%d" % i] = desc ["SetDisplay"]
+                expr = "int (f%d (prof, prof.%s))" % (i, x)
+            else:
+                raise ValueError ("Don't know how to encode parameter %s" % x)
+            code.append ("    v%d = %s" % (i, expr))
+            items.append ("v%d" % i)
+
+        # temporary hack until someone finds out what means the 23th byte
+        byte23 = [ctd.get ("Byte23") for ctd in ControllerTypeDesc]
+        if byte23.count (None) != len (byte23):
+            ns ["byte23"] = byte23
+            if items [23].isdigit ():
+                const ^= int (items [23])
+                code.append ("    v23 = %s" % items [23])
+                items [23] = "v23"
+            code.append ("    b = byte23 [prof.ControllerType - 1]")
+            code.append ("    if b is not None:")
+            code.append ("        v23 = b")
+
+        crc = [x for x in items if not x.isdigit ()]
+        if const or not crc:
+            crc.append ("%d" % const)
+        code.append ("    return bytearray ((%s, %s))" % (", ".join (items), " ^ ".join (crc)))
+
+        exec compile ("\n".join (code) + "\n", "<FrameEncoder>", "exec") in ns
+        self.Source = "\n".join (code)
+        self.Encode = ns ["Encode"]
+
+
+    def EncodeBatch (self, profs):
+        """Encode a sequence of profiles into one contiguous buffer"""
+        encode = self.Encode
+        return bytearray ().join ([encode (prof) for prof in profs])
+
+
+def FormatModel (prof, value):
+    # Hack for controller type: the model name follows the value
+    model = prof.GetModel ()
+    if model.find ('/') >= 0:
+        model = model [:model.find ('/')]
+    return "%d:%s\r\n" % (value, model)
+
+
+class AsvCodec:
+    """Reads and writes the parameters of a controller family in .asv
+    format. The parameter types are looked up once, and every parameter
+    gets an (attribute, parser, formatter) entry, so loading and saving
+    is a plain loop over the entries."""
+
+    def __init__ (self, ParamLoadOrder, ControllerParameters):
+        self.Entries = []
+        for parm in ParamLoadOrder:
+            desc = ControllerParameters [parm]
+            if desc ["Type"].find ('i') >= 0:
+                parser = int
+                if desc ["Type"].find ('/') >= 0:
+                    formatter = FormatModel
+                else:
+                    formatter = lambda prof, value: "%d\r\n" % value
+            elif desc ["Type"].find ('f') >= 0:
+                parser = float
+                mask = "%%.%df\r\n" % desc.get ("Precision", 1)
+                formatter = lambda prof, value, mask = mask: mask % value
+            else:
+                parser = formatter = None
+            self.Entries.append ((parm, parser, formatter))
+
+
+    def Load (self, prof, lines):
+        # Profile.Load () invalidates the cached frame once afterwards,
+        # skip Profile.__setattr__ doing it for every parameter
+        store = object.__setattr__
+        for (parm, parser, formatter), l in zip (self.Entries, lines):
+            if parser is None:
+                continue
+            # Remove extra shit from the string
+            l = l.strip ()
+            i = l.find (":")
+            if i >= 0:
+                l = l [:i]
+            store (prof, parm, parser (l))
+
+        for l in lines [len (self.Entries):]:
+            l = l.strip ()
+            i = l.find (":")
+            if i >= 0:
+                l = l [:i]
+            if len (l):
+                raise ValueError, \
+                    _("Extra data at the end of file:\n'%(data)s'") % \
+                    { "data" : l }
+
+
+    def Format (self, prof):
+        """Return the contents of the .asv file for given profile"""
+        return "".join ([formatter (prof, getattr (prof, parm))
+            for parm, parser, formatter in self.Entries if formatter != None])
+
+
+class FrameDecoder:
+    """The inverse of FrameEncoder: validates a raw data frame and rebuilds
+    a profile from it. Spin button values are restored with the displayed
+    precision, so encoding the profile back gives the same frame.
+
+    If the controller type is not sent in the frame (EB2xx), it is guessed
+    from the Byte23 hack value: a hint controller type is used if it fits,
+    otherwise a type with the same model name, otherwise the first one."""
+
+    def __init__ (self, ProfileClass, ParamRawOrder, ControllerTypeDesc, ControllerParameters):
+        self.ProfileClass = ProfileClass
+        self.ParamRawOrder = ParamRawOrder
+        self.ControllerTypeDesc = ControllerTypeDesc
+        self.ControllerParameters = ControllerParameters
+        self.FrameSize = len (ParamRawOrder) + 1
+        self.HasControllerType = "ControllerType" in ParamRawOrder
+
+        # Raw value -> parameter value maps for the ToRaw conversions
+        self.FromRaw = {}
+        prof = TableProfile (ControllerTypeDesc, 1)
+        for parm in ParamRawOrder:
+            if (type (parm) == str) and ControllerParameters [parm].has_key ("ToRaw"):
+                desc = ControllerParameters [parm]
+                minv, maxv = desc ["Range"]
+                self.FromRaw [parm] = dict ((int (desc ["ToRaw"] (prof, v)), v)
+                    for v in range (maxv, minv - 1, -1))
+
+
+    def GetFamily (self):
+        for fam in Families:
+            if fam [1] is self.ProfileClass:
+                return fam [0]
+        return None
+
+
+    def GuessControllerType (self, data, hint = None):
+        candidates = []
+        for ct in range (1, len (self.ControllerTypeDesc) + 1):
+            b23 = self.ControllerTypeDesc [ct - 1].get ("Byte23")
+            if b23 is None:
+                b23 = self.ParamRawOrder [23]
+            if b23 == data [23]:
+                candidates.append (ct)
+
+        if not candidates:
+            raise ValueError (_("Unknown controller type"))
+        if hint in candidates:
+            return hint
+
+        if (hint != None) and (hint >= 1) and (hint <= len (self.ControllerTypeDesc)):
+            model = self.ControllerTypeDesc [hint - 1]["Name"].split ('/') [0]
+            for ct in candidates:
+                if self.ControllerTypeDesc [ct - 1]["Name"].split ('/') [0] == model:
+                    return ct
+        return candidates [0]
+
+
+    def DisplayValue (self, prof, desc, raw):
+        # Round to the displayed precision, like SpinButtonValueChanged ()
+        # does. This loses information when there are several raw values
+        # per display step, so look for a nearby displayed value which
+        # encodes back to the same raw value.
+        exact = desc ["GetDisplay"] (prof, float (raw))
+        if desc ["Type"].find ('i') >= 0:
+            # .asv files keep integer parameters as integers
+            prec = 1.0
+        else:
+            prec = math.pow (10, desc.get ("Precision", 1))
+        val = round (exact * prec) / prec
+        for x in [val] + [val + sign * step / prec for step in range (1, 16) for sign in (1, -1)]:
+            x = round (x * prec) / prec
+            if int (desc ["SetDisplay"] (prof, x)) == raw:
+                if desc ["Type"].find ('i') >= 0:
+                    return int (x)
+                return x
+
+        # This raw value can't be entered in the GUI; keep the exact
+        # value so that at least the frame is rebuilt correctly
+        return exact
+
+
+    def Decode (self, data, fn = u"", hint = None):
+        """Build a profile from a raw data frame (a str or bytearray).
+        fn is the file name for the new profile, hint is the controller
+        type to assume if it can't be told from the frame.
+        Raises ValueError if the frame is broken."""
+        data = bytearray (data)
+        if len (data) != self.FrameSize:
+            raise ValueError (_("Invalid frame length %(len)d") % { "len" : len (data) })
+
+        crc = 0
+        for x in data [:-1]:
+            crc ^= x
+        if crc != data [-1]:
+            raise ValueError (_("Frame checksum mismatch"))
+
+        prof = self.ProfileClass (self.GetFamily (), fn)
+        if self.HasControllerType:
+            ct = self.FromRaw ["ControllerType"].get (data [self.ParamRawOrder.index ("ControllerType")])
+            if ct is None:
+                raise ValueError (_("Unknown controller type"))
+        else:
+            ct = self.GuessControllerType (data, hint)
+        prof.ControllerType = ct
+
+        b23 = self.ControllerTypeDesc [ct - 1].get ("Byte23")
+        for i in range (len (self.ParamRawOrder)):
+            parm = self.ParamRawOrder [i]
+            raw = data [i]
+            if type (parm) != str:
+                if (raw != parm) and not ((i == 23) and (raw == b23)):
+                    raise ValueError (_("Unexpected value %(val)d at offset %(ofs)d") % \
+                        { "val" : raw, "ofs" : i })
+                continue
+
+            desc = self.ControllerParameters [parm]
+            if self.FromRaw.has_key (parm):
+                val = self.FromRaw [parm].get (raw)
+                if val is None:
+                    raise ValueError (_("Invalid %(parm)s value %(val)d") % \
+                        { "parm" : parm, "val" : raw })
+            elif desc ["Widget"] == PWT_COMBOBOX:
+                minv, maxv = desc ["Range"]
+                if (raw < minv) or (raw > maxv):
+                    raise ValueError (_("Invalid %(parm)s value %(val)d") % \
+                        { "parm" : parm, "val" : raw })
+                val = raw
+            else:
+                val = self.DisplayValue (prof, desc, raw)
+            setattr (prof, parm, val)
+
+        return prof
+
+
+    def DecodeStream (self, f, name = u"Frame %d", hint = None, skip_bad = False):
+        """Decode a binary capture consisting of back-to-back frames,
+        yielding the profiles one by one. Profiles are named after
+        the frame number using the name template. Broken frames raise
+        ValueError, or are silently skipped if skip_bad is True."""
+        n = 0
+        while True:
+            data = f.read (self.FrameSize)
+            if len (data) < self.FrameSize:
+                if len (data) and not skip_bad:
+                    raise ValueError (_("Truncated frame %(n)d") % { "n" : n })
+                return
+
+            try:
+                yield self.Decode (data, name % n + ".asv", hint)
+            except ValueError, e:
+                if not skip_bad:
+                    raise ValueError (_("Frame %(n)d: %(msg)s") % { "n" : n, "msg" : e })
+            n += 1
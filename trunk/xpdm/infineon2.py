@@ -3,7 +3,6 @@
 #
 
 import serial
-import locale
 from xpdm import infineon
 
 # -- # Constants # -- #
@@ -597,11 +596,17 @@ automatically.\
     },
 }
 
+# Replace the conversion functions with lookup tables
+infineon.CompileTables (ControllerTypeDesc, ControllerParameters)
+
 # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- #
 
 
 class Profile (infineon.Profile):
 
+    ControllerTypeDesc = ControllerTypeDesc
+    ControllerParameters = ControllerParameters
+
     # Parameter order when loading from .asv files
     ParamLoadOrder = [
         "ControllerType", "PhaseCurrent", "BatteryCurrent", "HaltVoltage", \
@@ -611,6 +616,9 @@ class Profile (infineon.Profile):
         "GuardLevel", "ThrottleProtect", "PASMode", "P3Mode", "SensorAngle"
     ]
 
+    # Every parameter gets a slot instead of a __dict__ entry
+    __slots__ = ParamLoadOrder
+
     # The order of parameters in the profile edit dialog
     ParamEditOrder = [
         [ _("Hardware type") ],
@@ -682,54 +690,19 @@ class Profile (infineon.Profile):
     ]
 
 
-    def __init__ (self, Family, FileName):
-        infineon.Profile.__init__ (self, Family, FileName, \
-            ControllerTypeDesc, ControllerParameters)
-
-
-    def Upload (self, com_port, progress_func):
-        data = self.BuildRaw ()
-
-        try:
-            ser = serial.Serial (com_port, 9600, serial.EIGHTBITS, serial.PARITY_NONE,
-                serial.STOPBITS_ONE, timeout=0.2)
-        except serial.SerialException, e:
-            raise serial.SerialException (str (e).decode (locale.getpreferredencoding ()))
+    # Serial port settings used to talk to the controller
+    BaudRate = 9600
+    StopBits = serial.STOPBITS_ONE
 
-        progress_func (msg = _("Waiting for controller ready"))
-        # Send '8's and wait for the 'U' response
-        skip_write = False
-        while True:
-            if not skip_write:
-                ser.flushInput ()
-                ser.write ('8')
-            skip_write = False
+    # The reply sent by controller after it accepts the uploaded data
+    UploadAck = 'U'
 
-            c = ser.read ()
-            if c == 'U':
-                break
 
-            if len (c) > 0:
-                skip_write = True
-
-            if not progress_func ():
-                return False
-
-        progress_func (msg = _("Waiting acknowledgement"))
-        ser.flushInput ()
-        ser.write (str (data))
-        while True:
-            c = ser.read ()
-            if c == 'U':
-                return True
-
-            if len (c) > 0:
-                raise Exception (_("Invalid reply byte '%(chr)02x'") % { "chr" : ord (c) })
-
-            if not progress_func ():
-                break
-
-        return False
+Profile.Encoder = infineon.FrameEncoder (Profile.ParamRawOrder, \
+    ControllerTypeDesc, ControllerParameters)
+Profile.Decoder = infineon.FrameDecoder (Profile, Profile.ParamRawOrder, \
+    ControllerTypeDesc, ControllerParameters)
+Profile.Codec = infineon.AsvCodec (Profile.ParamLoadOrder, ControllerParameters)
 
 
 def DetectFormat2 (l):
@@ -746,4 +719,4 @@ def DetectFormat2 (l):
 
 
 infineon.RegisterFamily (_("Infineon 2"), Profile, DetectFormat2, \
-    (x ["Name"] for x in ControllerTypeDesc))
+    (x ["Name"] for x in ControllerTypeDesc), "EB2")
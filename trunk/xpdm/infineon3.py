@@ -3,8 +3,6 @@
 #
 
 import serial
-import time
-import locale
 from xpdm import infineon
 
 # -- # Constants # -- #
@@ -604,10 +602,16 @@ automatically.\
     },
 }
 
+# Replace the conversion functions with lookup tables
+infineon.CompileTables (ControllerTypeDesc, ControllerParameters)
+
 # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- #
 
 class Profile (infineon.Profile):
 
+    ControllerTypeDesc = ControllerTypeDesc
+    ControllerParameters = ControllerParameters
+
     # Parameter order when loading from .asv files
     ParamLoadOrder = [
         "ControllerType", "PhaseCurrent", "BatteryCurrent", "HaltVoltage", \
@@ -618,6 +622,9 @@ class Profile (infineon.Profile):
         "DefaultSpeed", "Speed4", "SensorAngle", "PASMaxSpeed", "LimitCruise"
     ]
 
+    # Every parameter gets a slot instead of a __dict__ entry
+    __slots__ = ParamLoadOrder
+
     # The order of parameters in the profile edit dialog
     ParamEditOrder = [
         [ _("Hardware type") ],
@@ -694,62 +701,21 @@ class Profile (infineon.Profile):
     ]
 
 
-    def __init__ (self, Family, FileName):
-        infineon.Profile.__init__ (self, Family, FileName, \
-            ControllerTypeDesc, ControllerParameters)
-
-
-    def Upload (self, com_port, progress_func):
-        data = self.BuildRaw ()
-
-        try:
-            ser = serial.Serial (com_port, 38400, serial.EIGHTBITS, serial.PARITY_NONE,
-                serial.STOPBITS_TWO, timeout=0.2)
-        except serial.SerialException, e:
-            raise serial.SerialException (str (e).decode (locale.getpreferredencoding ()))
-
-        progress_func (msg = _("Waiting for controller ready"))
-        # Send '8's and wait for the 'U' response
-        skip_write = False
-        while True:
-            if not skip_write:
-                # Garbage often comes from the controller upon bootup, just ignore it
-                ser.flushInput ()
-                ser.write ('8')
-            skip_write = False
+    # Serial port settings used to talk to the controller
+    BaudRate = 38400
+    StopBits = serial.STOPBITS_TWO
 
-            c = ser.read ()
-            if c == 'U':
-                break
+    # The reply sent by controller after it accepts the uploaded data
+    UploadAck = "QR"
+    # The reply sent by controller when uploaded data is broken
+    UploadNak = chr (0xa2)
 
-            if len (c) > 0:
-                skip_write = True
 
-            if not progress_func ():
-                return False
-
-        progress_func (msg = _("Waiting acknowledgement"))
-
-        ser.flushInput ()
-        ser.write (str (data))
-        ack = "QR"
-        while True:
-            c = ser.read ()
-            while len (c) and (c [0] == ack [0]):
-                c = c [1:]
-                ack = ack [1:]
-                if len (ack) == 0:
-                    return True
-
-            if len (c) > 0:
-                if c [0] == chr (0xa2):
-                    raise Exception (_("Controller says received data is broken"))
-                raise Exception (_("Invalid reply byte '%(chr)02x'") % { "chr" : ord (c [0]) })
-
-            if not progress_func ():
-                break
-
-        return False
+Profile.Encoder = infineon.FrameEncoder (Profile.ParamRawOrder, \
+    ControllerTypeDesc, ControllerParameters)
+Profile.Decoder = infineon.FrameDecoder (Profile, Profile.ParamRawOrder, \
+    ControllerTypeDesc, ControllerParameters)
+Profile.Codec = infineon.AsvCodec (Profile.ParamLoadOrder, ControllerParameters)
 
 
 def DetectFormat3 (l):
@@ -766,4 +732,4 @@ def DetectFormat3 (l):
 
 
 infineon.RegisterFamily (_("Infineon 3"), Profile, DetectFormat3, \
-    (x ["Name"] for x in ControllerTypeDesc))
+    (x ["Name"] for x in ControllerTypeDesc), "EB3")
@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+# Persistent index of profile files, so that we don't have to parse
+# every .asv file in the profile library on every start, and an in-memory
+# cache of recently used profiles.
+#
+
+import os
+import threading
+from collections import OrderedDict
+import xpdm
+from xpdm import FNENC, infineon
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+
+def ToUnicode (s):
+    # gettext.install () may give us either UTF-8 or unicode strings
+    if isinstance (s, unicode):
+        return s
+    return s.decode ("utf-8")
+
+
+class ProfileIndex:
+    """Caches the Family, Model and Description of every profile file,
+    keyed by file path. An entry is valid as long as the file has the
+    same modification time and size."""
+
+    def __init__ (self, fn, cache = None):
+        self.FileName = fn
+        # If a ProfileCache is given, profiles are loaded through it
+        self.Cache = cache
+        self.Entries = {}
+        self.Dirty = False
+        self.Lock = threading.Lock ()
+        self.Load ()
+
+
+    def Signature (self):
+        # Family names are translated, and models depend on the program
+        # version, so the index is thrown away when any of these change
+        return [ToUnicode (xpdm.VERSION)] + [ToUnicode (fam [0]) for fam in infineon.Families]
+
+
+    def Load (self):
+        try:
+            f = file (self.FileName.encode (FNENC), "r")
+            data = json.load (f)
+            f.close ()
+        except (IOError, ValueError):
+            return
+
+        if data.get ("Signature") == self.Signature ():
+            self.Entries = data.get ("Entries", {})
+
+
+    def Save (self):
+        self.Lock.acquire ()
+        try:
+            if not self.Dirty:
+                return
+
+            # Write to a temporary file first, so that a crash won't leave
+            # a truncated index behind
+            tmpfn = (self.FileName + ".tmp").encode (FNENC)
+            f = file (tmpfn, "w")
+            json.dump ({ "Signature" : self.Signature (), "Entries" : self.Entries }, f)
+            f.close ()
+            if os.name == "nt" and os.access (self.FileName.encode (FNENC), os.F_OK):
+                os.remove (self.FileName.encode (FNENC))
+            os.rename (tmpfn, self.FileName.encode (FNENC))
+            self.Dirty = False
+        finally:
+            self.Lock.release ()
+
+
+    def Stat (self, fn):
+        st = os.stat (fn.encode (FNENC))
+        return st.st_mtime, st.st_size
+
+
+    def Get (self, fn):
+        """Return the (Family, Model, Description) tuple for given file,
+        or None if the file is not in the index or has changed"""
+        try:
+            mtime, size = self.Stat (fn)
+        except OSError:
+            return None
+
+        self.Lock.acquire ()
+        try:
+            ent = self.Entries.get (fn)
+        finally:
+            self.Lock.release ()
+
+        if (ent is None) or (ent [0] != mtime) or (ent [1] != size):
+            return None
+        return tuple (ent [2:])
+
+
+    def Put (self, fn, prof, stat = None):
+        """Remember the data of a just loaded profile. If the file was
+        stat ()ed before loading, pass the (mtime, size) tuple as stat."""
+        try:
+            if stat is None:
+                stat = self.Stat (fn)
+        except OSError:
+            return
+        mtime, size = stat
+
+        self.Lock.acquire ()
+        try:
+            self.Entries [fn] = [mtime, size, prof.Family, prof.GetModel (), prof.Description]
+            self.Dirty = True
+        finally:
+            self.Lock.release ()
+
+
+    def Remove (self, fn):
+        self.Lock.acquire ()
+        try:
+            if self.Entries.has_key (fn):
+                del self.Entries [fn]
+                self.Dirty = True
+        finally:
+            self.Lock.release ()
+
+
+    def Prune (self, files):
+        """Remove all entries except those for the given files"""
+        files = set (files)
+        self.Lock.acquire ()
+        try:
+            for fn in self.Entries.keys ():
+                if fn not in files:
+                    del self.Entries [fn]
+                    self.Dirty = True
+        finally:
+            self.Lock.release ()
+
+
+    def Scan (self, fn):
+        """Return the (Family, Model, Description) tuple for given file,
+        either from the index, or by loading the profile. Returns None
+        if file format is unknown, and passes through IOError and ValueError
+        from infineon.LoadProfile ()"""
+        ent = self.Get (fn)
+        if ent != None:
+            return ent
+
+        # Stat before loading, so that if the file changes meanwhile
+        # it will be re-parsed next time
+        try:
+            stat = self.Stat (fn)
+        except OSError, e:
+            raise IOError (e.errno, e.strerror)
+
+        if self.Cache != None:
+            prof = self.Cache.Load (fn)
+        else:
+            prof = infineon.LoadProfile (fn)
+        if prof is None:
+            return None
+
+        self.Put (fn, prof, stat)
+        return (prof.Family, prof.GetModel (), prof.Description)
+
+
+class ProfileCache:
+    """Keeps up to Size recently loaded Profile objects, keyed by file path.
+    A cached profile is used as long as the file has the same modification
+    time and size. Profiles returned by Load () are shared, so copy.copy ()
+    them before changing anything."""
+
+    def __init__ (self, size = 32):
+        self.Size = size
+        self.Entries = OrderedDict ()
+        self.Lock = threading.Lock ()
+
+
+    def Load (self, fn):
+        """Same as infineon.LoadProfile (), but returns the cached
+        profile if the file didn't change since it was loaded"""
+        try:
+            st = os.stat (fn.encode (FNENC))
+        except OSError, e:
+            raise IOError (e.errno, e.strerror)
+        stat = (st.st_mtime, st.st_size)
+
+        self.Lock.acquire ()
+        try:
+            ent = self.Entries.pop (fn, None)
+            if (ent != None) and (ent [0] == stat):
+                # Move to the most recently used end
+                self.Entries [fn] = ent
+                return ent [1]
+        finally:
+            self.Lock.release ()
+
+        prof = infineon.LoadProfile (fn)
+        if prof is None:
+            return None
+
+        self.Lock.acquire ()
+        try:
+            self.Entries [fn] = (stat, prof)
+            while len (self.Entries) > self.Size:
+                self.Entries.popitem (last = False)
+        finally:
+            self.Lock.release ()
+
+        return prof
+
+
+    def Remove (self, fn):
+        self.Lock.acquire ()
+        try:
+            self.Entries.pop (fn, None)
+        finally:
+            self.Lock.release ()
+
+
+class ProfileScanner (threading.Thread):
+    """Scans a list of profile files through a ProfileIndex in a separate
+    thread. Results are passed in chunks to chunk_func (scanner, rows, done,
+    total) called from the scanner thread, where rows is a list of (file name,
+    index entry, error) tuples: the entry is the ProfileIndex.Scan () result
+    and error is the IOError or ValueError raised by it, if any. The last
+    call has done == total."""
+
+    def __init__ (self, index, files, chunk_func, chunk = 64):
+        threading.Thread.__init__ (self, name = "profile scanner")
+        self.setDaemon (True)
+        self.Index = index
+        self.Files = files
+        self.ChunkFunc = chunk_func
+        self.Chunk = chunk
+        self.Cancelled = threading.Event ()
+
+
+    def Cancel (self):
+        self.Cancelled.set ()
+
+
+    def run (self):
+        rows = []
+        for i in range (len (self.Files)):
+            if self.Cancelled.isSet ():
+                return
+
+            fn = self.Files [i]
+            ent = err = None
+            try:
+                ent = self.Index.Scan (fn)
+            except (IOError, ValueError), e:
+                err = e
+            rows.append ((fn, ent, err))
+
+            if len (rows) >= self.Chunk:
+                self.ChunkFunc (self, rows, i + 1, len (self.Files))
+                rows = []
+
+        if rows or not self.Files:
+            self.ChunkFunc (self, rows, len (self.Files), len (self.Files))
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+# Column store of profile parameters for auditing large profile libraries.
+# Every parameter of a controller family is kept in a NumPy array, one value
+# per profile, so queries over tens of thousands of profiles are answered
+# with array operations instead of loops over Profile objects.
+# Requires NumPy.
+#
+
+import os
+import glob
+import numpy
+from xpdm import FNENC, infineon
+
+
+class ProfileStore:
+    """Displayed parameter values (amps, volts etc, the same as Profile
+    attributes) of many profiles of the same controller family. Columns are
+    accessed as store [parm] and are float arrays of the same length;
+    besides ParamLoadOrder parameters there are also the "Path",
+    "Description" and "Model" columns. Combine the columns into a boolean
+    mask and pass it to Select (), for example:
+
+        s = stores [_("Infineon 3")]
+        s.Select ((s ["Model"] == "EB312") & (s ["PhaseCurrent"] > 40) &
+                  (s ["HaltVoltage"] < 36))
+    """
+
+    def __init__ (self, Family, ProfileClass):
+        self.Family = Family
+        self.ProfileClass = ProfileClass
+        self.ParamLoadOrder = ProfileClass.ParamLoadOrder
+        self.Models = [ctd ["Name"] for ctd in ProfileClass.ControllerTypeDesc]
+
+        # Rows added since the last Compact (), one list per column
+        self.Pending = dict ((parm, []) for parm in self.ParamLoadOrder)
+        self.PendingPaths = []
+        self.PendingDescriptions = []
+
+        self.Columns = dict ((parm, numpy.empty (0)) for parm in self.ParamLoadOrder)
+        self.Columns ["Path"] = numpy.empty (0, dtype = object)
+        self.Columns ["Description"] = numpy.empty (0, dtype = object)
+        self.Columns ["Model"] = numpy.empty (0, dtype = object)
+
+
+    def __len__ (self):
+        return len (self.Columns ["Path"]) + len (self.PendingPaths)
+
+
+    def __getitem__ (self, col):
+        self.Compact ()
+        return self.Columns [col]
+
+
+    def Add (self, prof):
+        """Append the parameters of a loaded profile"""
+        for parm in self.ParamLoadOrder:
+            self.Pending [parm].append (getattr (prof, parm))
+        self.PendingPaths.append (prof.FileName.decode (FNENC))
+        self.PendingDescriptions.append (prof.Description)
+
+
+    def Compact (self):
+        """Move the profiles added with Add () into the column arrays.
+        This is done automatically on first column access after Add ()."""
+        if not self.PendingPaths:
+            return
+
+        for parm in self.ParamLoadOrder:
+            self.Columns [parm] = numpy.concatenate ((self.Columns [parm],
+                numpy.array (self.Pending [parm], dtype = numpy.float64)))
+            self.Pending [parm] = []
+        for col, pending in ("Path", self.PendingPaths), ("Description", self.PendingDescriptions):
+            a = numpy.empty (len (pending), dtype = object)
+            a [:] = pending
+            self.Columns [col] = numpy.concatenate ((self.Columns [col], a))
+        self.PendingPaths = []
+        self.PendingDescriptions = []
+
+        # Same as Profile.GetModel (): element 0 is for unknown controller types
+        models = numpy.empty (len (self.Models) + 1, dtype = object)
+        models [:] = ["???"] + self.Models
+        ct = self.Columns ["ControllerType"].astype (numpy.intp)
+        ct [(ct < 1) | (ct > len (self.Models))] = 0
+        self.Columns ["Model"] = models [ct]
+
+
+    def Select (self, mask, col = "Path"):
+        """Return the list of values of given column (file names by default)
+        for all profiles where mask is True"""
+        return list (self [col][numpy.asarray (mask, dtype = bool)])
+
+
+    def Count (self, mask):
+        return int (numpy.count_nonzero (mask))
+
+
+def LoadFiles (files, stores = None, errors = None):
+    """Load the given .asv files into a dictionary of ProfileStore's keyed
+    by family name, which is created if not given. Files of unknown format
+    are skipped; if a list is passed as errors, a (file name, exception)
+    tuple is appended to it for every file which failed to load."""
+    if stores is None:
+        stores = {}
+
+    for fn in files:
+        try:
+            prof = infineon.LoadProfile (fn)
+        except (IOError, ValueError), e:
+            if errors != None:
+                errors.append ((fn, e))
+            continue
+        if prof is None:
+            continue
+
+        store = stores.get (prof.Family)
+        if store is None:
+            store = stores [prof.Family] = ProfileStore (prof.Family, prof.__class__)
+        store.Add (prof)
+
+    for store in stores.values ():
+        store.Compact ()
+    return stores
+
+
+def LoadDirectory (d, stores = None, errors = None):
+    """Load all .asv files from given directory, see LoadFiles ()"""
+    files = [x.decode (FNENC) for x in sorted (glob.glob (os.path.join (d.encode (FNENC), "*.asv")))]
+    return LoadFiles (files, stores, errors)
+
+
+def LoadIndex (index, family = None, models = None, stores = None, errors = None):
+    """Load the files listed in a profindex.ProfileIndex, see LoadFiles ().
+    Since the index knows the family and model of every file, the files
+    of other families (if family is given) or other models (if a list of
+    model names is given) are skipped without parsing."""
+    files = []
+    for fn, ent in sorted (index.Entries.items ()):
+        if (family != None) and (ent [2] != family):
+            continue
+        if (models != None) and (ent [3] not in models):
+            continue
+        files.append (fn)
+    return LoadFiles (files, stores, errors)
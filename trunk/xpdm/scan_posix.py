@@ -8,20 +8,288 @@ Part of pySerial (http://pyserial.sf.net)
 
 import serial
 import glob
+import os
+import errno
+import struct
+import fnmatch
+
+# Common Unix USB serial device names
+PortPatterns = ['/dev/ttyUSB*', '/dev/ttyACM*', '/dev/tty.usbserial*']
+
+# Where the kernel tells about the devices behind tty's
+SysfsRoot = '/sys'
+
+# The result of the last ScanPorts (), valid while a PortWatcher is
+# listening to hotplug events; see EnumeratePorts ()
+PortCache = None
+# The number of PortWatcher's getting hotplug events
+Watching = 0
+
+
+class PortInfo:
+    """Everything known about a serial port. For USB adapters VID and PID
+    are hex strings like "0403", Serial is the serial number, if any, and
+    Location is the bus path of the USB interface (like "1-1.2:1.0"),
+    which stays the same as long as the cable goes into the same socket.
+    These are None if not known."""
+
+    def __init__ (self, port):
+        self.Port = port
+        self.Desc = ""
+        self.HWID = ""
+        self.VID = None
+        self.PID = None
+        self.Serial = None
+        self.Location = None
+
+
+def ReadAttr (d, attr):
+    try:
+        f = open (os.path.join (d, attr))
+        try:
+            return f.read ().strip ()
+        finally:
+            f.close ()
+    except IOError:
+        return None
+
+
+def SysfsInfo (info):
+    """Fill the USB device data of a port from sysfs"""
+    dev = os.path.join (SysfsRoot, "class/tty", os.path.basename (info.Port), "device")
+    if not os.path.exists (dev):
+        return
+
+    # Walk up from the tty device to the USB device (the one with idVendor),
+    # the directory just below it is the USB interface
+    path = os.path.realpath (dev)
+    intf = None
+    while len (path) > len (SysfsRoot):
+        if os.path.exists (os.path.join (path, "idVendor")):
+            break
+        intf = path
+        path = os.path.dirname (path)
+    else:
+        return
+
+    info.VID = ReadAttr (path, "idVendor")
+    info.PID = ReadAttr (path, "idProduct")
+    info.Serial = ReadAttr (path, "serial")
+    info.Location = os.path.basename (intf or path)
+    info.Desc = ReadAttr (path, "product") or ""
+    info.HWID = "USB VID:PID=%s:%s" % (info.VID, info.PID)
+    if info.Serial:
+        info.HWID += " SNR=%s" % info.Serial
+    info.HWID += " LOCATION=%s" % info.Location
+
+
+def ScanPorts ():
+    """Look through the device directory and sysfs for serial ports,
+    returns a sorted list of PortInfo's"""
+    ports = []
+    for pattern in PortPatterns:
+        ports += glob.glob(pattern)
+
+    result = []
+    for port in sorted (ports):
+        info = PortInfo (port)
+        SysfsInfo (info)
+        result.append (info)
+    return result
+
+
+def EnumeratePorts ():
+    """Return the list of PortInfo's for all serial ports. While a
+    PortWatcher is watching for hotplug events, the list is scanned only
+    once and then returned from cache until some port comes or goes, so
+    there's no filesystem access on repeated calls. The list is shared,
+    don't change it."""
+    global PortCache
+    if PortCache != None:
+        return PortCache
+
+    ports = ScanPorts ()
+    if Watching:
+        PortCache = ports
+    return ports
+
+
+def InvalidatePorts ():
+    global PortCache
+    PortCache = None
+
 
 def comports(available_only=True):
     """This generator scans the device directory for com ports and yields
     (order, port, desc, hwid).  available_only is ignored for Windows compatibility,
     Order is a helper to get sorted lists. it can be ignored otherwise."""
     order = 1
-    # Common Unix USB serial device names
-    for port in sorted (glob.glob('/dev/ttyUSB*') + glob.glob('/dev/tty.usbserial*')):
+    for info in EnumeratePorts ():
         # this would give wrong results on opened com ports
         #if available_only:
         #    try:
-        #        serial.Serial(port) # test open
+        #        serial.Serial(info.Port) # test open
         #    except serial.serialutil.SerialException:
         #        continue
 
-        yield order, port, "", ""
+        yield order, info.Port, info.Desc, info.HWID
         order += 1
+
+
+# inotify (7) constants
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 02000000
+
+# struct inotify_event header: wd, mask, cookie, len
+InotifyEvent = struct.Struct("iIII")
+
+
+def Inotify ():
+    """Return the libc inotify functions, or None if not available"""
+    try:
+        import ctypes, ctypes.util
+        libc = ctypes.CDLL (ctypes.util.find_library ("c"), use_errno = True)
+        return libc.inotify_init1, libc.inotify_add_watch
+    except (ImportError, OSError, AttributeError):
+        return None
+
+
+class PortWatcher:
+    """Reports serial ports appearing and disappearing. On Linux it uses
+    inotify on /dev, so that nothing is done until a device node is created
+    or removed: add fileno () to your poll loop and call Dispatch () when it
+    becomes readable. Where inotify is not available, fileno () returns None
+    and Dispatch () must be called periodically; it rescans the ports then.
+
+    Subscribers are called as func (port, added) for every change, in the
+    order the changes happened. Ports holds the current set of ports."""
+
+    def __init__ (self):
+        global Watching
+        self.Subscribers = []
+        self.fd = None
+        # Watch descriptor -> watched directory
+        self.Dirs = {}
+
+        funcs = Inotify ()
+        if funcs != None:
+            init, add_watch = funcs
+            fd = init (IN_NONBLOCK | IN_CLOEXEC)
+            if fd >= 0:
+                dirs = set (os.path.dirname (x) for x in PortPatterns)
+                for d in dirs:
+                    wd = add_watch (fd, d, IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO)
+                    if wd < 0:
+                        os.close (fd)
+                        fd = -1
+                        break
+                    self.Dirs [wd] = d
+            if fd >= 0:
+                self.fd = fd
+                Watching += 1
+
+        # Scan after the watch is set up, so that no change is lost
+        InvalidatePorts ()
+        self.Ports = self.Scan ()
+
+
+    def Scan (self):
+        return set (port for order, port, desc, hwid in comports ())
+
+
+    def Subscribe (self, func):
+        self.Subscribers.append (func)
+
+
+    def Unsubscribe (self, func):
+        self.Subscribers.remove (func)
+
+
+    def fileno (self):
+        return self.fd
+
+
+    def Notify (self, port, added):
+        if added:
+            if port in self.Ports:
+                return
+            self.Ports.add (port)
+        else:
+            if port not in self.Ports:
+                return
+            self.Ports.remove (port)
+
+        for func in self.Subscribers [:]:
+            func (port, added)
+
+
+    def Rescan (self):
+        InvalidatePorts ()
+        ports = self.Scan ()
+        for port in sorted (self.Ports - ports):
+            self.Notify (port, False)
+        for port in sorted (ports - self.Ports):
+            self.Notify (port, True)
+
+
+    def Dispatch (self):
+        """Process all pending changes. Returns True, so that it can be
+        used directly as a glib I/O watch or timeout callback."""
+        if self.fd is None:
+            self.Rescan ()
+            return True
+
+        data = ""
+        while True:
+            try:
+                chunk = os.read (self.fd, 4096)
+            except OSError, e:
+                if e.errno in (errno.EAGAIN, errno.EINTR):
+                    break
+                raise
+            if not chunk:
+                break
+            data += chunk
+
+        if data:
+            # Some device node came or went, scan again on next request
+            InvalidatePorts ()
+
+        pos = 0
+        overflow = False
+        while pos + InotifyEvent.size <= len (data):
+            wd, mask, cookie, length = InotifyEvent.unpack_from (data, pos)
+            name = data [pos + InotifyEvent.size : pos + InotifyEvent.size + length].rstrip ("\0")
+            pos += InotifyEvent.size + length
+
+            if mask & IN_Q_OVERFLOW:
+                overflow = True
+                continue
+
+            if not self.Dirs.has_key (wd):
+                continue
+            port = os.path.join (self.Dirs [wd], name)
+            for pattern in PortPatterns:
+                if fnmatch.fnmatchcase (port, pattern):
+                    self.Notify (port, (mask & (IN_CREATE | IN_MOVED_TO)) != 0)
+                    break
+
+        # Some events were lost, find out the changes the hard way
+        if overflow:
+            self.Rescan ()
+        return True
+
+
+    def Close (self):
+        global Watching
+        if self.fd != None:
+            os.close (self.fd)
+            self.fd = None
+            Watching -= 1
+            if not Watching:
+                InvalidatePorts ()
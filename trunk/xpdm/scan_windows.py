@@ -208,3 +208,87 @@ def comports(available_only=True):
         yield order, port_name, szFriendlyName.value, szHardwareID.value
 
     SetupDiDestroyDeviceInfoList(g_hdi)
+
+
+class PortInfo:
+    """Everything known about a serial port, same as in the POSIX version.
+    Only VID, PID and the serial number can be told from the hardware ID
+    here; Location is None."""
+
+    def __init__ (self, port):
+        self.Port = port
+        self.Desc = ""
+        self.HWID = ""
+        self.VID = None
+        self.PID = None
+        self.Serial = None
+        self.Location = None
+
+
+def EnumeratePorts ():
+    """Return the list of PortInfo's for all serial ports"""
+    ports = []
+    for order, port, desc, hwid in sorted (comports ()):
+        info = PortInfo (port)
+        info.Desc = desc
+        info.HWID = hwid
+        # Like "FTDIBUS\VID_0403+PID_6001+A123A\0000" or "USB\VID_2341&PID_0043\5&1F"
+        m = re.search (r"VID_([0-9a-fA-F]{4}).PID_([0-9a-fA-F]{4})(?:.([^\\]+))?", hwid)
+        if m:
+            info.VID = m.group (1).lower ()
+            info.PID = m.group (2).lower ()
+            # Instance IDs with '&' are made up by Windows, not serial numbers
+            if m.group (3) and (m.group (3).find ('&') < 0):
+                info.Serial = m.group (3)
+        ports.append (info)
+    return ports
+
+
+class PortWatcher:
+    """Reports serial ports appearing and disappearing, same as the POSIX
+    version, but there are no device change notifications without a window
+    to receive WM_DEVICECHANGE: fileno () returns None, and Dispatch () must
+    be called periodically to rescan the ports.
+
+    Subscribers are called as func (port, added) for every change.
+    Ports holds the current set of ports."""
+
+    def __init__ (self):
+        self.Subscribers = []
+        self.Ports = self.Scan ()
+
+
+    def Scan (self):
+        return set (port for order, port, desc, hwid in comports ())
+
+
+    def Subscribe (self, func):
+        self.Subscribers.append (func)
+
+
+    def Unsubscribe (self, func):
+        self.Subscribers.remove (func)
+
+
+    def fileno (self):
+        return None
+
+
+    def Dispatch (self):
+        """Rescan the ports and report the changes. Returns True, so that
+        it can be used directly as a glib timeout callback."""
+        ports = self.Scan ()
+        removed = sorted (self.Ports - ports)
+        added = sorted (ports - self.Ports)
+        self.Ports = ports
+        for port in removed:
+            for func in self.Subscribers [:]:
+                func (port, False)
+        for port in added:
+            for func in self.Subscribers [:]:
+                func (port, True)
+        return True
+
+
+    def Close (self):
+        pass
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+# Simulated Infineon-style controllers for testing and benchmarking uploads
+# without real hardware. Every simulated controller sits on the master side
+# of a pseudo-terminal, and the slave side is used as a serial port name
+# for Profile.Upload (). POSIX only.
+#
+
+import os
+import pty
+import tty
+import random
+import threading
+from xpdm import evloop
+
+# Simulated controller families
+SIM_EB2XX = 0
+SIM_EB3XX = 1
+
+# What controllers of every family reply after receiving the data
+SimAck = [ 'U', "QR" ]
+
+# The reply sent when received data is broken
+SIM_NAK = chr (0xa2)
+
+# Random bytes sent upon boot; 'U' is excluded so that it's not taken for 'ready'
+GarbageBytes = [chr (x) for x in range (256) if x != 0x55]
+
+# The length of the frame sent by Profile.BuildRaw (), including checksum
+FRAME_SIZE = 32
+
+
+def OpenPty ():
+    """Create a pseudo-terminal pair in raw mode.
+    Returns a (master fd, slave fd, slave device name) tuple."""
+    master, slave = pty.openpty ()
+    # Otherwise the terminal line discipline would echo and mangle our data
+    tty.setraw (master)
+    tty.setraw (slave)
+    return master, slave, os.ttyname (slave)
+
+
+def Checksum (data):
+    crc = 0
+    for x in data [:-1]:
+        crc ^= x
+    return crc
+
+
+class Controller:
+    """Emulates a controller waiting to be programmed.
+
+    family      - SIM_EB2XX or SIM_EB3XX
+    fd          - the file descriptor to talk through; if None, a new
+                  pseudo-terminal is created and Port is its slave name
+    boot_delay  - seconds after power on before the controller replies
+    garbage     - the amount of random bytes sent upon boot ('U' excluded)
+    naks        - reject this many first uploads as broken
+    nak_rate    - the probability to reject any other upload as broken
+    latency     - seconds to wait before sending every reply
+    frames      - stop after this many successful uploads (None = never)
+    max_received - stop after this many frames received, rejected or not
+                   (None = never)
+    """
+
+    def __init__ (self, family = SIM_EB3XX, fd = None, boot_delay = 0.0, garbage = 0,
+                  naks = 0, nak_rate = 0.0, latency = 0.0, frames = None,
+                  max_received = None):
+        self.Family = family
+        self.Slave = None
+        self.Port = None
+        if fd is None:
+            fd, self.Slave, self.Port = OpenPty ()
+        self.fd = fd
+        self.BootDelay = boot_delay
+        self.Garbage = garbage
+        self.Naks = naks
+        self.NakRate = nak_rate
+        self.Latency = latency
+        self.MaxFrames = frames
+        self.MaxReceived = max_received
+
+        # All frames received so far, including the rejected ones
+        self.Frames = []
+        # Successful and rejected uploads counters
+        self.Uploads = 0
+        self.Rejected = 0
+
+
+    def Close (self):
+        for fd in self.fd, self.Slave:
+            if fd != None:
+                os.close (fd)
+        self.fd = self.Slave = None
+
+
+    def Done (self):
+        if (self.MaxFrames != None) and (self.Uploads >= self.MaxFrames):
+            return True
+        return (self.MaxReceived != None) and (len (self.Frames) >= self.MaxReceived)
+
+
+    def Reply (self, data):
+        if self.Latency > 0:
+            yield evloop.Sleep (self.Latency)
+        os.write (self.fd, data)
+
+
+    def Run (self):
+        """The coroutine that emulates the controller"""
+        while not self.Done ():
+            # Power on: the controller ignores everything until booted
+            if self.BootDelay > 0:
+                yield evloop.Sleep (self.BootDelay)
+                # Drop everything received while booting
+                while (yield evloop.Readable (self.fd, 0)):
+                    os.read (self.fd, 4096)
+            if self.Garbage > 0:
+                os.write (self.fd, ''.join (random.choice (GarbageBytes)
+                    for x in range (self.Garbage)))
+
+            # Wait for a '8'
+            while True:
+                yield evloop.Readable (self.fd)
+                if '8' in os.read (self.fd, 4096):
+                    break
+
+            for x in self.Reply ('U'):
+                yield x
+
+            # Receive the frame; the '8's that were sent by the host before
+            # it received our 'U' are skipped
+            data = bytearray ()
+            while len (data) < FRAME_SIZE:
+                if not (yield evloop.Readable (self.fd, 1.5)):
+                    break
+                c = os.read (self.fd, 4096)
+                if len (data) == 0:
+                    c = c.lstrip ('8')
+                data.extend (c)
+
+            if len (data) < FRAME_SIZE:
+                # Timed out, start from scratch
+                continue
+
+            data = data [:FRAME_SIZE]
+            self.Frames.append (data)
+
+            if (data [-1] != Checksum (data)) or (self.Naks > 0) or \
+               (random.random () < self.NakRate):
+                self.Naks = max (0, self.Naks - 1)
+                self.Rejected += 1
+                for x in self.Reply (SIM_NAK):
+                    yield x
+            else:
+                self.Uploads += 1
+                for x in self.Reply (SimAck [self.Family]):
+                    yield x
+
+        raise evloop.Return (True)
+
+
+class Simulator:
+    """A bunch of simulated controllers running in a background thread.
+    Add all the controllers first, then Start () the simulator."""
+
+    def __init__ (self):
+        self.Loop = evloop.EventLoop ()
+        self.Controllers = []
+        self.Thread = None
+        self.WakeupPipe = os.pipe ()
+
+
+    def Add (self, family = SIM_EB3XX, **kwargs):
+        ctl = Controller (family, **kwargs)
+        self.Controllers.append (ctl)
+        return ctl
+
+
+    def Ports (self):
+        return [ctl.Port for ctl in self.Controllers]
+
+
+    def Start (self):
+        self.Stopper = self.Loop.Spawn (self.WaitStop ())
+        self.Tasks = [self.Loop.Spawn (ctl.Run (), ctl.Port) for ctl in self.Controllers]
+        self.Thread = threading.Thread (target = self.Run, name = "simulator")
+        self.Thread.setDaemon (True)
+        self.Thread.start ()
+
+
+    def WaitStop (self):
+        yield evloop.Readable (self.WakeupPipe [0])
+        # Cancel from inside the loop, otherwise it would block in poll ()
+        # on the controllers' descriptors before noticing we're done
+        for t in self.Tasks:
+            t.Cancel ()
+
+
+    def Run (self):
+        self.Loop.Run ()
+
+
+    def Stop (self):
+        if self.Thread != None:
+            os.write (self.WakeupPipe [1], 'x')
+            self.Thread.join ()
+            self.Thread = None
+
+        for ctl in self.Controllers:
+            ctl.Close ()
+        for fd in self.WakeupPipe:
+            os.close (fd)
+        self.WakeupPipe = ()
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+# Station mode: every serial port is bound to a profile, and the profile is
+# uploaded automatically whenever a controller shows up on the port, with
+# no operator action. Every bound port which is present keeps an upload
+# waiting in the handshake (sending '8's until the controller replies 'U'),
+# so plugging a controller in or pressing the cable button is enough.
+#
+
+import time
+import select
+import threading
+from xpdm import PortWatcher, EnumeratePorts, infineon, fleet
+
+# Seconds after a port appears during which it may still be unusable,
+# until udev sets the device node permissions
+SETTLE_TIME = 3.0
+
+
+class StationPort:
+    """A bound port which is currently present"""
+
+    def __init__ (self, port, prof):
+        self.Port = port
+        self.Profile = prof
+        self.Worker = None
+        self.Cancel = threading.Event ()
+        self.AddTime = time.time ()
+        # The port went away, the entry is dropped once the worker exits
+        self.Gone = False
+        # Don't start the next upload before this time
+        self.ArmTime = 0
+        # Failed uploads in a row, to back off from broken ports
+        self.Failures = 0
+
+
+class Station:
+    """Uploads the bound profiles to controllers as they come.
+
+    bindings    - a dictionary mapping either port names (like /dev/ttyUSB0)
+                  or USB locations (PortInfo.Location, like "1-1.2:1.0", which
+                  stick to the USB socket) to Profile objects
+    log         - a file to append a line for every finished upload to
+    report_func - if given, called as report_func (port, prof, status, msg,
+                  elapsed) for every finished upload
+    rearm       - seconds to wait after an upload before listening on the
+                  port again, so that the same controller is not programmed
+                  twice while the cable button is still held
+    """
+
+    def __init__ (self, bindings, log = None, report_func = None, handshake = None,
+                  cadence = 0.2, rearm = 2.0):
+        self.Bindings = bindings
+        self.Log = log
+        self.ReportFunc = report_func
+        self.Handshake = handshake
+        self.Cadence = cadence
+        self.Rearm = rearm
+        self.Ports = {}
+        self.Stopped = threading.Event ()
+        self.NextScan = 0
+
+        self.Watcher = PortWatcher ()
+        self.Watcher.Subscribe (self.PortChanged)
+        for port in self.Watcher.Ports:
+            self.PortChanged (port, True)
+
+
+    def BoundProfile (self, port):
+        """Return the profile bound to given port, or None"""
+        prof = self.Bindings.get (port)
+        if prof is None:
+            for info in EnumeratePorts ():
+                if (info.Port == port) and (info.Location != None):
+                    prof = self.Bindings.get (info.Location)
+                    break
+        return prof
+
+
+    def PortChanged (self, port, added):
+        sp = self.Ports.get (port)
+        if added:
+            prof = self.BoundProfile (port)
+            if prof is None:
+                return
+            if sp is None:
+                self.Ports [port] = StationPort (port, prof)
+            elif sp.Gone:
+                # Back before the old worker exited, Poll () waits for it
+                sp.Profile = prof
+                sp.Gone = False
+                sp.AddTime = time.time ()
+                sp.Failures = 0
+        elif sp != None:
+            sp.Gone = True
+            sp.Cancel.set ()
+
+
+    def Finished (self, sp):
+        w = sp.Worker
+        sp.Worker = None
+
+        # The device node of a just plugged adapter is not accessible until
+        # udev gets to it, so failing to open it then is not a failure
+        if (w.Status == fleet.FUS_FAILED) and (w.Phase == infineon.UPH_OPEN) and \
+           (w.StartTime - sp.AddTime < SETTLE_TIME):
+            sp.ArmTime = time.time () + self.Cadence
+            return
+
+        if w.Status == fleet.FUS_FAILED:
+            sp.Failures += 1
+        else:
+            sp.Failures = 0
+        sp.ArmTime = time.time () + min (self.Rearm * (2 ** sp.Failures), 60)
+
+        # An upload cancelled because the port went away is not worth a line
+        if (w.Status == fleet.FUS_CANCELLED) and sp.Cancel.isSet ():
+            return
+
+        if self.Log != None:
+            self.Log.write ("%s\t%s\t%s\t%s\t%.1f\t%s\n" % (
+                time.strftime ("%Y-%m-%d %H:%M:%S"), sp.Port,
+                w.Profile.Description.encode ("utf-8"), fleet.FleetStatusName [w.Status],
+                w.Elapsed, (w.Message or "").encode ("utf-8")))
+            self.Log.flush ()
+        if self.ReportFunc:
+            self.ReportFunc (sp.Port, w.Profile, w.Status, w.Message, w.Elapsed)
+
+
+    def Poll (self):
+        """Collect finished uploads and start listening on idle ports"""
+        now = time.time ()
+        for port, sp in self.Ports.items ():
+            if (sp.Worker != None) and not sp.Worker.isAlive ():
+                self.Finished (sp)
+            if sp.Worker != None:
+                continue
+            if sp.Gone:
+                del self.Ports [port]
+            elif (now >= sp.ArmTime) and not self.Stopped.isSet ():
+                sp.Cancel.clear ()
+                sp.Worker = fleet.PortUpload (sp.Profile, sp.Port, sp.Cancel,
+                    handshake = self.Handshake, cadence = self.Cadence)
+                sp.Worker.start ()
+
+
+    def Run (self):
+        """Serve the ports until Stop () is called"""
+        while not self.Stopped.isSet ():
+            self.Poll ()
+            if self.Watcher.fileno () != None:
+                if select.select ([self.Watcher], [], [], 0.2) [0]:
+                    self.Watcher.Dispatch ()
+            else:
+                time.sleep (0.2)
+                # No hotplug events here, rescan now and then
+                if time.time () >= self.NextScan:
+                    self.Watcher.Dispatch ()
+                    self.NextScan = time.time () + 1
+
+        for sp in self.Ports.values ():
+            sp.Cancel.set ()
+        for sp in self.Ports.values ():
+            if sp.Worker != None:
+                sp.Worker.join ()
+                self.Finished (sp)
+        self.Watcher.Close ()
+
+
+    def Stop (self):
+        self.Stopped.set ()